@@ -1,94 +1,1064 @@
 import asyncio
+import base64
+import hashlib
+import hmac
 import re
-import requests
+import string
+import time
 import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+import openai
 from openai import AsyncOpenAI
-from typing import Dict, List
+from typing import Callable, Dict, Final, List
 import os
 from dotenv import load_dotenv
 from broker_profiles import BROKER_PROFILES, get_broker_info, compare_brokers
-from broker_training_data import BROKER_QA_PAIRS, BROKER_COMPARISONS, SCENARIO_RECOMMENDATIONS
+from broker_training_data import BROKER_QA_PAIRS, SCENARIO_RECOMMENDATIONS
 import httpx
 
+# aiohttp transport for the OpenAI client holds up far better than httpx's
+# default under many concurrent requests; needs the openai[aiohttp] extra
+try:
+    import httpx_aiohttp  # noqa: F401
+    from openai import DefaultAioHttpClient
+except ImportError:
+    DefaultAioHttpClient = None
+# Aho-Corasick scores all language keywords in one scan of the message;
+# without it detect_language checks each keyword separately
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# System prompts for generate_ai_response. The static persona block per
+# language is sent first and byte-identical on every call so OpenAI's
+# automatic prompt caching can reuse it as a prefix; the per-request context
+# (keyed by (language, context_key)) follows in a separate system message.
+# The 'forex_brokers' contexts carry a {brokers} placeholder.
+_PERSONA_PROMPTS: Final[Dict[str, str]] = {
+    'ms': (
+        "Kau ni RentungBot_Ai - assistant pintar yang pakar dalam broker Valetax dan trading! "
+        "Jawab dalam Bahasa Malaysia yang natural macam cakap dengan kawan baik. "
+        "Pakai 'awak', 'lah', 'je', 'kan', 'tak' naturally dalam conversation. "
+
+        "PERSONALITY: Friendly, knowledgeable, helpful, encouraging tapi realistic pasal risks. "
+        "CONTEXT MALAYSIA: "
+        "- Guna RM (ringgit) sebagai currency reference "
+        "- Sebut payment methods local: online banking, TNG eWallet, FPX "
+        "- Malaysian trading hours: 4PM-1AM (London session terbaik) "
+        "- Bank Negara Malaysia untuk regulation reference "
+        "- EPF, KWSP, salary ranges RM2k-5k untuk relatable examples "
+        "- Consider M40/B40 income levels dan priorities "
+
+        "TRADING APPROACH: "
+        "- Start small (RM100-500 untuk beginner) "
+        "- Risk management FIRST (max 1-2% per trade) "
+        "- Demo account practice essential "
+        "- Selalu mention importance of stop loss "
+        "- Recommend Valetax sebagai broker pilihan dengan leverage tinggi dan deposit rendah "
+
+        "CONVERSATION STYLE: "
+        "- Jawab soalan dengan detail yang helpful "
+        "- Guna examples yang relatable untuk Malaysian context "
+        "- Mix BM dengan common English trading terms naturally "
+        "- If tanya complex stuff, break down step by step "
+        "- ALWAYS end setiap response dengan: 'Nak berbual dengan agent sebenar? Type /agent' "
+        "- Keep responses CONCISE - match user's message length (short questions = short answers) "
+    ),
+    'id': (
+        "Anda adalah RentungBot_Ai - asisten pintar yang ahli dalam broker Valetax dan trading! "
+        "Jawab dalam Bahasa Indonesia yang natural seperti berbicara dengan teman baik. "
+        "Gunakan 'Anda', 'bisa', 'dong', 'nih', 'sih' secara natural dalam percakapan. "
+
+        "PERSONALITY: Ramah, berpengetahuan, membantu, mendorong tapi realistis tentang risiko. "
+        "KONTEKS INDONESIA: "
+        "- Gunakan Rupiah (IDR) sebagai referensi mata uang "
+        "- Sebutkan metode pembayaran lokal: transfer bank, e-wallet, virtual account "
+        "- Jam trading Indonesia: 21:00-06:00 WIB (sesi London terbaik) "
+        "- Bank Indonesia untuk referensi regulasi "
+        "- Gaji rata-rata Rp 5-15 juta untuk contoh yang relatable "
+        "- Pertimbangkan level ekonomi menengah Indonesia "
+
+        "PENDEKATAN TRADING: "
+        "- Mulai kecil (Rp 500rb-2juta untuk pemula) "
+        "- Risk management PERTAMA (maksimal 1-2% per trade) "
+        "- Latihan demo account sangat penting "
+        "- Selalu sebutkan pentingnya stop loss "
+        "- Rekomendasikan Valetax sebagai broker pilihan dengan leverage tinggi dan deposit rendah "
+
+        "GAYA PERCAKAPAN: "
+        "- Jawab pertanyaan dengan detail yang membantu "
+        "- Gunakan contoh yang relatable untuk konteks Indonesia "
+        "- Campur Bahasa Indonesia dengan istilah trading yang umum secara natural "
+        "- Jika pertanyaan kompleks, jelaskan step by step "
+        "- SELALU akhiri setiap respons dengan: 'Mau ngobrol dengan agen sungguhan? Ketik /agent' "
+        "- Jaga respons RINGKAS - sesuaikan dengan panjang pesan user (pertanyaan pendek = jawaban pendek) "
+    ),
+    'en': (
+        "You are RentungBot_Ai, a smart assistant specializing in Valetax broker and forex trading. "
+        "You have deep knowledge of Valetax services, forex markets, trading strategies, and risk management. "
+
+        "PERSONALITY: Helpful, knowledgeable, encouraging but realistic about trading risks. "
+        "APPROACH: "
+        "- Give comprehensive but concise answers "
+        "- Use practical examples and analogies "
+        "- Always emphasize proper risk management "
+        "- Encourage safe learning progression "
+        "- Be supportive but honest about trading challenges "
+
+        "TRADING PRINCIPLES: "
+        "- Start with demo accounts and small amounts "
+        "- Never risk more than 1-2% per trade "
+        "- Recommend Valetax as preferred broker with high leverage and low minimum deposits "
+        "- Focus on education before big investments "
+        "- Stop losses are mandatory, not optional "
+        "- ALWAYS end responses with: 'Want to talk to a real person? Type /agent' "
+        "- Keep responses CONCISE - match the user's message length "
+    ),
+}
+
+# Short persona for non-forex chat: the trading principles and local market
+# context above are dead weight when the model is told to answer off-topic
+# questions first, so they are only sent once forex intent is detected.
+GENERAL_PROMPT_BASES: Final[Dict[str, str]] = {
+    'ms': (
+        "Kau ni RentungBot_Ai - assistant pintar yang pakar dalam broker Valetax dan trading! "
+        "Jawab dalam Bahasa Malaysia yang natural macam cakap dengan kawan baik. "
+        "PERSONALITY: Friendly, knowledgeable, helpful. "
+        "- Kalau relevan, sebut yang awak boleh tolong pasal forex trading, jangan paksa "
+        "- ALWAYS end setiap response dengan: 'Nak berbual dengan agent sebenar? Type /agent' "
+        "- Keep responses CONCISE - match user's message length "
+    ),
+    'id': (
+        "Anda adalah RentungBot_Ai - asisten pintar yang ahli dalam broker Valetax dan trading! "
+        "Jawab dalam Bahasa Indonesia yang natural seperti berbicara dengan teman baik. "
+        "PERSONALITY: Ramah, berpengetahuan, membantu. "
+        "- Jika relevan, sebutkan bahwa Anda bisa membantu soal forex trading, jangan dipaksakan "
+        "- SELALU akhiri setiap respons dengan: 'Mau ngobrol dengan agen sungguhan? Ketik /agent' "
+        "- Jaga respons RINGKAS - sesuaikan dengan panjang pesan user "
+    ),
+    'en': (
+        "You are RentungBot_Ai, a smart assistant specializing in Valetax broker and forex trading. "
+        "PERSONALITY: Helpful, knowledgeable, friendly. "
+        "- If relevant, mention you can help with forex trading, but don't force it "
+        "- ALWAYS end responses with: 'Want to talk to a real person? Type /agent' "
+        "- Keep responses CONCISE - match the user's message length "
+    ),
+}
+
+SYSTEM_PROMPT_CONTEXTS: Final[Dict[tuple, str]] = {
+    ('ms', 'greeting'): (
+        "USER CONTEXT: First interaction - be welcoming and introduce capabilities naturally. "
+        "Mention you can help with forex basics, broker selection, trading strategies, risk management. "
+    ),
+    ('ms', 'forex_brokers'): (
+        "USER CONTEXT: Asking about specific brokers: {brokers}. "
+        "Give detailed comparison with Malaysian perspective (regulation, spreads, support, deposit methods). "
+    ),
+    ('ms', 'forex'): (
+        "USER CONTEXT: Forex-related question. Give comprehensive answer with Malaysian context. "
+        "Include practical examples, risk warnings, and encourage learning step by step. "
+    ),
+    ('ms', 'general'): (
+        "USER CONTEXT: Non-forex question. Answer helpfully first, then naturally mention "
+        "your forex expertise if relevant. Don't force the transition. "
+    ),
+    ('id', 'greeting'): (
+        "KONTEKS USER: Interaksi pertama - sambut dengan ramah dan perkenalkan kemampuan secara natural. "
+        "Sebutkan bisa membantu dengan dasar forex, pemilihan broker, strategi trading, manajemen risiko. "
+    ),
+    ('id', 'forex_brokers'): (
+        "KONTEKS USER: Menanyakan broker spesifik: {brokers}. "
+        "Berikan perbandingan detail dengan perspektif Indonesia (regulasi, spread, support, metode deposit). "
+    ),
+    ('id', 'forex'): (
+        "KONTEKS USER: Pertanyaan terkait forex. Berikan jawaban komprehensif dengan konteks Indonesia. "
+        "Sertakan contoh praktis, peringatan risiko, dan dorong pembelajaran bertahap. "
+    ),
+    ('id', 'general'): (
+        "KONTEKS USER: Pertanyaan non-forex. Jawab dengan membantu dulu, lalu secara natural sebutkan "
+        "keahlian forex jika relevan. Jangan dipaksakan transisinya. "
+    ),
+    ('en', 'greeting'): (
+        "USER CONTEXT: First interaction - welcome them and naturally introduce your forex expertise. "
+        "Mention you can help with trading basics, broker selection, strategies, and risk management. "
+    ),
+    ('en', 'forex_brokers'): (
+        "USER CONTEXT: Asking about specific brokers: {brokers}. "
+        "Provide detailed comparison including regulation, spreads, platforms, and user experience. "
+    ),
+    ('en', 'forex'): (
+        "USER CONTEXT: Forex-related question. Give thorough answer with practical examples. "
+        "Include risk warnings and encourage gradual learning approach. "
+    ),
+    ('en', 'general'): (
+        "USER CONTEXT: Non-forex question. Answer their question first, then naturally "
+        "mention your forex specialization if there's a relevant connection. "
+    ),
+}
+
+# OpenAI only caches prompt prefixes of 1024+ tokens, so persona blocks that
+# fall short get a fixed reference appendix. Tokens are estimated at 5 chars
+# each, which undercounts o200k_base on English prose (~4-4.5 chars/token),
+# and the floor sits well above 1024, so the estimate only ever errs towards
+# padding. tests/test_prompt_cache.py checks the real counts with tiktoken.
+_PROMPT_CACHE_MIN_TOKENS: Final = 1200
+_CHARS_PER_TOKEN: Final = 5
+
+_FOREX_GLOSSARY: Final[str] = (
+    "FOREX GLOSSARY: "
+    "Pip - smallest standard price move, 0.0001 for most pairs and 0.01 for JPY pairs. "
+    "Lot - a standard lot is 100,000 units of the base currency; mini lot 10,000; micro lot 1,000. "
+    "Spread - difference between bid and ask price, the main cost of a trade. "
+    "Leverage - borrowed exposure; 1:100 means $1 of margin controls $100, magnifying profits and losses alike. "
+    "Margin - deposit required to open and hold a leveraged position. "
+    "Margin call - warning that equity is close to the required margin. "
+    "Stop out - broker closes positions when the margin level drops below its threshold. "
+    "Stop loss - order that closes a losing trade at a preset price. "
+    "Take profit - order that closes a winning trade at a preset price. "
+    "Drawdown - decline from the account's peak equity. "
+    "Swap - overnight financing charge or credit for positions held past rollover. "
+    "Slippage - execution at a different price than requested, common around news releases. "
+    "Major pairs - EUR/USD, GBP/USD, USD/JPY, USD/CHF, AUD/USD, USD/CAD, NZD/USD. "
+    "Pip value - about $10 per standard lot, $1 per mini lot and $0.10 per micro lot on USD-quoted pairs such as EUR/USD. "
+    "Position sizing - lot size = amount risked / (stop loss distance in pips x pip value per lot); "
+    "e.g. risking $10 with a 20 pip stop on EUR/USD means 0.05 lots. "
+    "Risk-reward ratio - expected profit divided by amount risked; 1:2 means targeting twice the risk. "
+    "Trading sessions - Asian (Tokyo), European (London) and US (New York); the London-New York overlap is usually the most liquid. "
+)
+
+
+def _render_reference_block() -> str:
+    """Render the static Valetax facts and glossary appended to short persona prompts"""
+    valetax = BROKER_PROFILES['valetax']
+    conditions = valetax['trading_conditions']
+    regulation = valetax['regulation']
+    parts = [
+        "\n\nREFERENCE DATA (use these facts when relevant, never paste them wholesale): ",
+        f"Valetax regulation: {', '.join(regulation['primary_regulators'])}. {regulation['regulatory_concerns']} ",
+    ]
+    for account_name, account in conditions['account_types'].items():
+        parts.append(
+            f"Valetax {account_name}: minimum deposit {account['minimum_deposit']}, spreads {account['spreads']}, "
+            f"leverage {account['leverage']}, commission {account['commission']} - {account['features']}. "
+        )
+    parts.append(
+        f"Valetax instruments: {conditions['instruments']}; minimum trade size {conditions['minimum_trade_size']}; "
+        f"platforms: {', '.join(valetax['platforms_tools']['trading_platforms'])}. "
+    )
+    parts.append(f"Valetax pros: {'; '.join(valetax['pros'])}. ")
+    parts.append(f"Valetax cons: {'; '.join(valetax['cons'])}. ")
+    for qa_data in BROKER_QA_PAIRS.get('valetax', {}).values():
+        parts.append(f"{qa_data['answer_en']} ")
+    for scenario in SCENARIO_RECOMMENDATIONS.values():
+        picks = [
+            f"{choice['broker']} ({'; '.join(choice['reasons_en'])})"
+            for choice_key, choice in scenario['recommendations'].items()
+            if choice_key in ('1st_choice', '2nd_choice')
+        ]
+        parts.append(f"{scenario['title_en']}: {', then '.join(picks)}. ")
+    parts.append(_FOREX_GLOSSARY)
+    return ''.join(parts)
+
+
+_REFERENCE_BLOCK: Final[str] = _render_reference_block()
+
+# Persona blocks, padded with the reference appendix where they fall short
+# of the prompt-cache threshold
+SYSTEM_PROMPT_BASES: Final[Dict[str, str]] = {
+    language: base + _REFERENCE_BLOCK if len(base) // _CHARS_PER_TOKEN < _PROMPT_CACHE_MIN_TOKENS else base
+    for language, base in _PERSONA_PROMPTS.items()
+}
+
+# Ready-made system message per (language, context) so each request only
+# allocates its own context and user messages. Never mutate these.
+_BASE_SYSTEM_MESSAGES: Final[Dict[tuple, Dict[str, str]]] = {
+    (language, context_key): {
+        "role": "system",
+        "content": (GENERAL_PROMPT_BASES if context_key == 'general' else SYSTEM_PROMPT_BASES)[language]
+    }
+    for language in SYSTEM_PROMPT_BASES
+    for context_key in ('greeting', 'forex_brokers', 'forex', 'general')
+}
+# Context messages with no per-request substitution ('forex_brokers' needs the
+# broker names); used whenever there is no conversation context to append
+_STATIC_CONTEXT_MESSAGES: Final[Dict[tuple, Dict[str, str]]] = {
+    (language, context_key): {"role": "system", "content": SYSTEM_PROMPT_CONTEXTS[(language, context_key)]}
+    for language in SYSTEM_PROMPT_BASES
+    for context_key in ('greeting', 'forex', 'general')
+}
+# Context prompt plus the caller's conversation context, rendered in one
+# format call; 'forex_brokers' also fills {brokers}
+_CONTEXT_PROMPT_TEMPLATES: Final[Dict[tuple, str]] = {
+    key: prompt + "\nAdditional Context: {context}"
+    for key, prompt in SYSTEM_PROMPT_CONTEXTS.items()
+}
+
+
+# Small single-word keyword groups are matched against the message's word
+# set: a frozenset hit is one hash probe per word, with no per-keyword
+# substring scan, so even groups of a handful of words are cheaper this way.
+_PUNCTUATION: Final[str] = string.punctuation.replace("'", '')
+_PUNCT_TABLE: Final[Dict[int, int]] = str.maketrans(_PUNCTUATION, ' ' * len(_PUNCTUATION))
+
+_ID_INDICATORS: Final = frozenset({'gimana', 'dong', 'nih', 'banget', 'emang', 'nggak', 'bisa', 'rupiah'})
+_MS_INDICATORS: Final = frozenset({'lah', 'leh', 'jer', 'je', 'nak', 'ringgit', 'boleh'})  # plus 'kat mana'
+_EN_INDICATORS: Final = frozenset({'the', 'and', 'or', 'but', 'dollar', 'dollars', 'cannot'})
+# detect_language scoring keywords (substring matches). Malay and Indonesian
+# share much of their vocabulary, so the common words are stored once.
+_SHARED_MS_ID_KEYWORDS: Final = (
+    'saya', 'aku', 'kamu', 'dengan', 'untuk', 'dari', 'yang', 'ini', 'itu', 'sudah', 'belum',
+    'mengapa', 'kenapa', 'siapa', 'mau', 'belajar', 'trading', 'forex', 'saham', 'broker', 'platform'
+)
+_ID_ONLY_KEYWORDS: Final = (
+    'anda', 'bisa', 'tidak', 'nggak', 'bagaimana', 'dimana', 'kapan', 'ingin', 'butuh', 'perlu',
+    'rupiah', 'investasi', 'gimana', 'dong', 'nih', 'deh', 'sih', 'banget', 'emang'
+)
+_MS_ONLY_KEYWORDS: Final = (
+    'awak', 'boleh', 'tak', 'tak boleh', 'macam mana', 'kat mana', 'bila', 'nak', 'hendak',
+    'perlukan', 'ringgit', 'pelaburan', 'lah', 'leh', 'la', 'ke', 'jer', 'je', 'kan', 'gak'
+)
+_EN_KEYWORDS: Final = (
+    'i', 'you', 'me', 'my', 'your', 'with', 'for', 'from', 'that', 'this',
+    'can', 'cannot', 'could', 'would', 'should', 'will', 'have', 'has', 'had',
+    'how', 'what', 'why', 'when', 'where', 'who', 'want', 'need', 'learn',
+    'trading', 'forex', 'dollar', 'investment', 'stock', 'broker', 'platform',
+    'the', 'and', 'or', 'but', 'so', 'because', 'if', 'then', 'than'
+)
+_LANGUAGE_KEYWORD_GROUPS: Final = (_SHARED_MS_ID_KEYWORDS, _ID_ONLY_KEYWORDS, _MS_ONLY_KEYWORDS, _EN_KEYWORDS)
+
+
+def _build_language_automaton():
+    """Map each scoring keyword to (keyword, indexes of the groups it belongs to)"""
+    automaton = ahocorasick.Automaton()
+    for group, keywords in enumerate(_LANGUAGE_KEYWORD_GROUPS):
+        for keyword in keywords:
+            _, groups = automaton.get(keyword, (keyword, ()))
+            automaton.add_word(keyword, (keyword, groups + (group,)))
+    automaton.make_automaton()
+    return automaton
+
+
+_LANGUAGE_AUTOMATON: Final = _build_language_automaton() if ahocorasick is not None else None
+
+
+def _language_keyword_scores(message_lower: str) -> List[int]:
+    """Count the distinct keywords of each _LANGUAGE_KEYWORD_GROUPS group found in the message"""
+    scores = [0] * len(_LANGUAGE_KEYWORD_GROUPS)
+    if _LANGUAGE_AUTOMATON is None:
+        for group, keywords in enumerate(_LANGUAGE_KEYWORD_GROUPS):
+            scores[group] = sum(1 for word in keywords if word in message_lower)
+        return scores
+    # A keyword occurring several times still counts once, as with `in`
+    for _, groups in {match for _, match in _LANGUAGE_AUTOMATON.iter(message_lower)}:
+        for group in groups:
+            scores[group] += 1
+    return scores
+
+
+_GREETING_WORDS: Final = frozenset({'hello', 'hi', 'hai', 'assalamualaikum', 'selamat', 'start'})  # plus 'good morning'
+
+# detect_query_type categories in priority order; the first matching category wins
+_QUERY_TYPE_KEYWORDS: Final[tuple] = (
+    ('spreads', ('spread', 'pip', 'eur/usd', 'eurusd')),
+    ('minimum_deposit', ('minimum deposit', 'min deposit', 'deposit')),
+    ('platforms', ('mt5', 'mt4', 'metatrader', 'platform')),
+    ('regulation', ('regulated', 'regulation', 'license', 'safe')),
+    ('leverage', ('leverage', 'margin')),
+    ('warnings', ('warning', 'risk', 'problem', 'issue')),
+    ('beginner_recommendation', ('beginner', 'new', 'start', 'pemula')),
+    ('scalping_recommendation', ('scalping', 'scalp')),
+    ('professional_recommendation', ('professional', 'high volume', 'volume tinggi')),
+)
+_QUERY_TYPE_PRIORITY: Final[Dict[str, int]] = {
+    query_type: priority for priority, (query_type, _) in enumerate(_QUERY_TYPE_KEYWORDS)
+}
+# One zero-width lookahead per position keeps overlapping keywords visible
+_QUERY_TYPE_RE: Final = re.compile('(?=' + '|'.join(
+    f"(?P<{query_type}>{'|'.join(map(re.escape, keywords))})"
+    for query_type, keywords in _QUERY_TYPE_KEYWORDS
+) + ')')
+
+
+def _compile_any(keywords) -> re.Pattern:
+    """Compile keywords into one alternation matching any of them as a substring"""
+    return re.compile('|'.join(map(re.escape, sorted(set(keywords), key=len, reverse=True))))
+
+
+# is_forex_related vocabulary (substring matches), scanned in one regex pass
+_FOREX_TERMS_RE: Final = _compile_any((
+    'forex', 'trading', 'currency', 'pair', 'pip', 'spread', 'leverage', 'margin',
+    'broker', 'chart', 'analysis', 'technical', 'fundamental', 'support', 'resistance',
+    'trend', 'bull', 'bear', 'long', 'short', 'buy', 'sell', 'profit', 'loss',
+    'strategy', 'scalping', 'swing', 'position', 'market', 'exchange', 'rate',
+    # Malaysian terms
+    'mata wang', 'perdagangan', 'pasaran', 'analisis', 'strategi', 'keuntungan',
+    'kerugian', 'carta', 'teknikal', 'asas', 'sokongan', 'rintangan',
+    'rugi', 'untung', 'trade', 'handle loss', 'manage risk', 'stop loss',
+    # Indonesian terms
+    'mata uang', 'pasar', 'grafik', 'dukungan', 'perlawanan',
+    'kelola kerugian', 'manajemen risiko',
+    # English phrases
+    'learn trade', 'learn trading', 'manage loss', 'trading loss',
+    'how to trade', 'trading tips', 'risk management',
+    # Malaysian phrases
+    'nak belajar trade', 'belajar trading', 'loss dalam trading',
+    'macam mana nak', 'cara nak trade', 'tips trading',
+    # Indonesian phrases
+    'belajar trade', 'gimana cara', 'bagaimana cara', 'cara trading',
+))
+
+
+# needs_live_agent: technical analysis, advanced concepts and explicit agent requests
+_LIVE_AGENT_RE: Final = _compile_any((
+    # Technical analysis
+    'fibonacci retracement', 'elliott wave', 'harmonic pattern', 'divergence analysis',
+    'ichimoku cloud', 'bollinger band', 'rsi divergence', 'macd histogram',
+    'pivot point calculation', 'stochastic oscillator', 'williams %r',
+    'market structure', 'price action', 'volume profile', 'order flow',
+    'scalping strategy', 'day trading', 'swing trading', 'position sizing',
+    'correlation analysis', 'carry trade', 'hedging strategy',
+    'news trading', 'economic calendar', 'fundamental analysis',
+    # Advanced trading concepts
+    'algorithmic trading', 'expert advisor', 'automated trading',
+    'backtesting', 'forward testing', 'optimization',
+    'risk management', 'portfolio management', 'money management',
+    'drawdown', 'sharpe ratio', 'risk-reward ratio',
+    'margin call', 'stop out', 'margin requirement',
+    'slippage', 'requote', 'spread widening',
+    # Live agent requests
+    'live agent', 'human agent', 'real person', 'customer service',
+    'support team', 'help desk', 'representative', 'advisor',
+    'agent sebenar', 'manusia sebenar', 'customer support',
+    'nak cakap dengan orang', 'minta tolong staff', 'agent bantuan',
+    'agen sungguhan', 'manusia asli',
+    'mau bicara dengan orang', 'agen bantuan',
+))
+
+# _detect_intent keyword groups, checked in priority order
+_INDICATOR_RE: Final = _compile_any((
+    'indicator', 'indikator', 'high level', 'engulfing', 'engulfing indicator',
+    'rentungfx indicator', 'trading indicator', 'mt4 indicator', 'mt5 indicator',
+    'custom indicator', 'price action indicator', 'signal indicator',
+))
+_INDICATOR_ACTION_RE: Final = _compile_any((
+    'register', 'daftar', 'access', 'get', 'download', 'dapat', 'nak', 'want', 'mau', 'ingin',
+))
+_REGISTRATION_RE: Final = _compile_any((
+    'register', 'daftar', 'join', 'signup', 'sign up', 'masuk', 'sertai',
+    'vip', 'channel', 'premium', 'member', 'membership', 'ahli',
+))
+
+# handle_broker_inquiry: a comparison request between two named brokers
+_COMPARE_RE: Final = _compile_any(('compare', 'comparison', 'vs'))
+
+
+@dataclass(frozen=True, slots=True)
+class _MessageCtx:
+    """Views of one user message, computed once per turn and shared by every detector"""
+    lower: str
+    words: tuple  # lowercased words with punctuation stripped
+    tokens: frozenset
+    word_count: int  # whitespace-separated words of the original text
+
+    @classmethod
+    def of(cls, message: str) -> '_MessageCtx':
+        lower = message.lower()
+        words = tuple(lower.translate(_PUNCT_TABLE).split())
+        return cls(lower, words, frozenset(words), len(message.split()))
+
+
+_LANGUAGES: Final = ('en', 'ms', 'id')
+
+# Messages longer than this are classified in a worker thread so a large
+# paste cannot stall the event loop; shorter ones stay inline
+_OFFLOAD_THRESHOLD_CHARS: Final = 1024
+
+# Short messages repeat a lot ("vip", "what is forex"), so their
+# (language, intent) is memoized on the exact lowercased text
+_CLASSIFY_CACHE_MAX_CHARS: Final = 128
+_CLASSIFY_CACHE_MAX_ENTRIES: Final = 2048
+# Broker answers depend only on the message text and language, so short
+# questions share the same memo bound
+_BROKER_REPLY_CACHE_MAX_ENTRIES: Final = 512
+
+# Chat models: the cheaper default handles the short replies this bot gives,
+# detailed broker comparisons and long forex questions get the premium model
+_DEFAULT_MODEL: Final = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini')
+_PREMIUM_MODEL: Final = os.getenv('OPENAI_PREMIUM_MODEL', 'gpt-4o')
+_PREMIUM_MIN_MESSAGE_CHARS: Final = 140
+
+
+def _choose_model(context_key: str, message_chars: int) -> str:
+    """Pick the chat model for a prompt context and message length"""
+    if context_key == 'forex_brokers':
+        return _PREMIUM_MODEL
+    if context_key == 'forex' and message_chars >= _PREMIUM_MIN_MESSAGE_CHARS:
+        return _PREMIUM_MODEL
+    return _DEFAULT_MODEL
+
+
+# Off-topic and greeting chats only get a short steer back to forex, so they
+# never need the long-answer budget
+_SHORT_REPLY_CONTEXTS: Final = frozenset({'greeting', 'general'})
+
+
+def _output_budget(context_key: str, message_words: int) -> int:
+    """max_tokens for a reply, scaled to the question's length and context"""
+    if message_words <= 10:  # Short question
+        return 80
+    if message_words <= 30 or context_key in _SHORT_REPLY_CONTEXTS:  # Medium question
+        return 140
+    return 220  # Long forex question
+
+
+# Concurrent OpenAI completions per process, and SDK retries on 429/5xx
+_OPENAI_CONCURRENCY: Final = int(os.getenv('OPENAI_CONCURRENCY', '16'))
+_OPENAI_MAX_RETRIES: Final = int(os.getenv('OPENAI_MAX_RETRIES', '3'))
+# Per-attempt timeout. The SDK default is 10 minutes, which would let one
+# stalled call hold a semaphore slot long after the user has given up.
+_OPENAI_TIMEOUT: Final = httpx.Timeout(float(os.getenv('OPENAI_TIMEOUT_SECONDS', '30')), connect=5.0)
+
+# Repeated beginner questions are answered from memory: keyed on the
+# normalized message plus everything else that shapes the prompt
+_RESPONSE_CACHE_MAX_ENTRIES: Final = 2000
+_RESPONSE_CACHE_TTL_SECONDS: Final = 24 * 60 * 60
+
+# Registration links are valid for 30 minutes; reuse one for 25 so a cached
+# link always has at least 5 minutes left when it is handed out
+_LINK_TOKEN_TTL_SECONDS: Final = 30 * 60
+_LINK_CACHE_TTL_SECONDS: Final = 25 * 60
+_LINK_CACHE_MAX_ENTRIES: Final = 10000
+
+# Conversation context longer than this is replaced by a short summary so
+# prompt size stays flat as a session grows; summaries are kept per context
+_CONTEXT_SUMMARY_THRESHOLD_CHARS: Final = 2000
+_CONTEXT_SUMMARY_MAX_TOKENS: Final = 300
+_CONTEXT_SUMMARY_MAX_ENTRIES: Final = 1000
+_CONTEXT_SUMMARY_MODEL: Final = "gpt-4o-mini"
+
+# Broker answers resolved per language at import, falling back to English
+_QA_INDEX: Final[Dict[tuple, str]] = {
+    (broker, query_type, language): qa_data.get(f'answer_{language}', qa_data['answer_en'])
+    for broker, qa_pairs in BROKER_QA_PAIRS.items()
+    for query_type, qa_data in qa_pairs.items()
+    for language in _LANGUAGES
+}
+
+
+def _render_scenario(scenario: Dict, language: str) -> str:
+    """Render a scenario recommendation with its top two broker choices"""
+    title = scenario.get(f'title_{language}', scenario['title_en'])
+    parts = [f"**{title}**\n\n"]
+
+    for choice_key, medal, trailer in (('1st_choice', '🥇', "\n"), ('2nd_choice', '🥈', "")):
+        if choice_key in scenario['recommendations']:
+            choice = scenario['recommendations'][choice_key]
+            reasons = choice.get(f'reasons_{language}', choice['reasons_en'])
+            parts.append(f"**{medal} {choice['broker']}:**\n")
+            parts.extend(f"• {reason}\n" for reason in reasons)
+            parts.append(trailer)
+
+    return ''.join(parts)
+
+
+_SCENARIO_RESPONSES: Final[Dict[tuple, str]] = {
+    (scenario_key, language): _render_scenario(scenario, language)
+    for scenario_key, scenario in SCENARIO_RECOMMENDATIONS.items()
+    for language in _LANGUAGES
+}
+
+# A greeting is bare, and skips the model entirely, when every word is a
+# greeting word or one of these fillers ("hello there", "selamat pagi")
+_BARE_GREETING_TOKENS: Final = _GREETING_WORDS | {
+    'good', 'morning', 'there', 'pagi', 'petang', 'malam', 'siang', 'sore', "what's", 'up',
+}
+
+# Replies to greeting-only messages, which skip the model entirely
+_GREETING_REPLIES: Final[Dict[str, str]] = {
+    'ms': (
+        "Hai! 👋 Saya RentungBot_Ai, assistant awak untuk forex trading dan broker Valetax. "
+        "Saya boleh tolong pasal forex basics, pilih broker, strategy trading dan risk management. "
+        "Nak mula dengan apa?\n\n"
+        "Nak berbual dengan agent sebenar? Type /agent"
+    ),
+    'id': (
+        "Halo! 👋 Saya RentungBot_Ai, asisten Anda untuk forex trading dan broker Valetax. "
+        "Saya bisa bantu soal dasar forex, pemilihan broker, strategi trading, dan manajemen risiko. "
+        "Mau mulai dari mana?\n\n"
+        "Mau ngobrol dengan agen sungguhan? Ketik /agent"
+    ),
+    'en': (
+        "Hi there! 👋 I'm RentungBot_Ai, your assistant for forex trading and the Valetax broker. "
+        "I can help with trading basics, broker selection, strategies and risk management. "
+        "What would you like to start with?\n\n"
+        "Want to talk to a real person? Type /agent"
+    ),
+}
+
+# Canned process_message replies keyed by (kind, language); templates with a
+# link take it via .format(url=...)
+_RESPONSES: Final[Dict[tuple, str]] = {
+    ('registration_error', 'ms'): (
+        "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
+        "Untuk mendaftar, hubungi admin kami untuk proses pendaftaran.\n\n"
+        "Group Chat Fighter Rentung ada:\n"
+        "• Trading signals quality tinggi 📊\n"
+        "• Daily market analysis dari expert\n"
+        "• Tips broker terbaik untuk Malaysian\n"
+        "• Support dari experienced trader community"
+    ),
+    ('registration_error', 'id'): (
+        "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
+        "Untuk mendaftar, hubungi admin kami untuk proses pendaftaran.\n\n"
+        "Group Chat Fighter Rentung punya:\n"
+        "• Trading signal berkualitas tinggi 📊\n"
+        "• Analisis pasar harian dari expert\n"
+        "• Tips broker terbaik untuk Indonesia\n"
+        "• Support dari komunitas trader berpengalaman"
+    ),
+    ('registration_error', 'en'): (
+        "🎯 Register for Group Chat Fighter Rentung now!\n\n"
+        "To register, contact our admin for the registration process.\n\n"
+        "Our Group Chat Fighter Rentung offers:\n"
+        "• High-quality trading signals 📊\n"
+        "• Daily market analysis by experts\n"
+        "• Best broker tips for Malaysians\n"
+        "• Support from experienced trader community"
+    ),
+    ('registration', 'ms'): (
+        "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
+        "Group Chat Fighter Rentung ada:\n"
+        "• Trading signals quality tinggi 📊\n"
+        "• Daily market analysis dari expert (focus Asian + London session)\n"
+        "• Tips broker mana yang best untuk Malaysian\n"
+        "• Support dari experienced Malaysian trader community\n"
+        "• Strategy sesuai untuk working adults (lepas kerja trading)\n\n"
+        "Klik link di bawah untuk lengkapkan pendaftaran:\n{url}\n\n"
+        "⏰ Link ini akan expired dalam 30 minit.\n"
+        "Lepas register, team kita akan semak dan contact dalam 24-48 jam untuk Group Chat Fighter Rentung access!"
+    ),
+    ('registration', 'id'): (
+        "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
+        "Group Chat Fighter Rentung punya:\n"
+        "• Trading signal berkualitas tinggi 📊\n"
+        "• Analisis pasar harian dari expert (fokus sesi Asia + London)\n"
+        "• Tips broker mana yang terbaik untuk Indonesia\n"
+        "• Support dari komunitas trader Indonesia berpengalaman\n"
+        "• Strategi cocok untuk pekerja (trading setelah kerja)\n\n"
+        "Klik link di bawah untuk melengkapi pendaftaran:\n{url}\n\n"
+        "⏰ Link ini akan expired dalam 30 menit.\n"
+        "Setelah daftar, tim kami akan review dan menghubungi dalam 24-48 jam untuk akses Group Chat Fighter Rentung!"
+    ),
+    ('registration', 'en'): (
+        "🎯 Register for Group Chat Fighter Rentung now!\n\n"
+        "Our Group Chat Fighter Rentung offers:\n"
+        "• High-quality trading signals 📊\n"
+        "• Daily market analysis by experts\n"
+        "• Latest trading tips and strategies\n"
+        "• Support from experienced trader community\n"
+        "• Guidance to become a profitable trader 💰\n\n"
+        "Click the link below to complete registration:\n{url}\n\n"
+        "⏰ This link will expire in 30 minutes.\n"
+        "Once you register, our team will review and contact you within 24-48 hours for Group Chat Fighter Rentung access!"
+    ),
+    ('indicator_registration', 'ms'): (
+        "🎯 **High Level Engulfing Indicator Registration**\n\n"
+        "Dapatkan akses kepada indicator trading yang powerful!\n\n"
+        "🔥 **Apa yang anda dapat:**\n"
+        "• High Level Engulfing Indicator untuk MT4/MT5\n"
+        "• Complete setup guide dan tutorial\n"
+        "• Sokongan teknikal dari team kami\n"
+        "• Strategy panduan untuk maksimum profit\n\n"
+        "📝 **Untuk mendaftar, gunakan command:**\n"
+        "👉 `/indicator`\n\n"
+        "⏰ Proses pendaftaran mengambil masa 2-3 minit sahaja!\n"
+        "✅ Anda akan menerima akses setelah diluluskan admin."
+    ),
+    ('indicator_registration', 'id'): (
+        "🎯 **Registrasi High Level Engulfing Indicator**\n\n"
+        "Dapatkan akses ke indicator trading yang powerful!\n\n"
+        "🔥 **Apa yang Anda dapat:**\n"
+        "• High Level Engulfing Indicator untuk MT4/MT5\n"
+        "• Complete setup guide dan tutorial\n"
+        "• Support teknis dari tim kami\n"
+        "• Panduan strategi untuk profit maksimal\n\n"
+        "📝 **Untuk mendaftar, gunakan command:**\n"
+        "👉 `/indicator`\n\n"
+        "⏰ Proses registrasi hanya membutuhkan 2-3 menit!\n"
+        "✅ Anda akan mendapat akses setelah disetujui admin."
+    ),
+    ('indicator_registration', 'en'): (
+        "🎯 **High Level Engulfing Indicator Registration**\n\n"
+        "Get access to powerful trading indicator!\n\n"
+        "🔥 **What you'll get:**\n"
+        "• High Level Engulfing Indicator for MT4/MT5\n"
+        "• Complete setup guide and tutorials\n"
+        "• Technical support from our team\n"
+        "• Strategy guidance for maximum profit\n\n"
+        "📝 **To register, use the command:**\n"
+        "👉 `/indicator`\n\n"
+        "⏰ Registration process takes only 2-3 minutes!\n"
+        "✅ You'll get access after admin approval."
+    ),
+    ('empty_ai_response', 'ms'): (
+        "Maaf, saya ada masalah sikit nak process soalan awak tu. "
+        "Boleh try tanya dengan cara lain? Atau awak boleh tanya pasal "
+        "forex basics, broker recommendation, atau trading strategy!"
+    ),
+    ('empty_ai_response', 'id'): (
+        "Maaf, saya ada masalah sedikit untuk proses pertanyaan Anda. "
+        "Bisa coba tanya dengan cara lain? Atau Anda bisa tanya tentang "
+        "forex basics, rekomendasi broker, atau strategi trading!"
+    ),
+    ('empty_ai_response', 'en'): (
+        "Sorry, I'm having trouble processing your question right now. "
+        "Could you try asking it differently? Or ask about "
+        "forex basics, broker recommendations, or trading strategies!"
+    ),
+    ('unanswerable', 'ms'): (
+        "Hm, saya tak sure macam mana nak jawab soalan ni dengan baik. "
+        "Boleh awak try tanya dengan cara lain atau tanya soalan lain? "
+        "Kalau awak berminat pasal forex trading, saya boleh tolong dengan tu!"
+    ),
+    ('unanswerable', 'id'): (
+        "Hmm, saya nggak yakin gimana cara terbaik jawab pertanyaan itu. "
+        "Bisa coba tanya dengan cara lain atau tanya pertanyaan lain? "
+        "Kalau Anda tertarik sama forex trading, saya pasti bisa bantu!"
+    ),
+    ('unanswerable', 'en'): (
+        "I'm not sure how to best answer that question. "
+        "Could you try asking it differently or ask another question? "
+        "If you're interested in forex trading, I can definitely help with that!"
+    ),
+    ('registration_suggestion', 'ms'): (
+        "{body}\n\n💡 Awak ni memang active bertanya! "
+        "Nak join Group Chat Fighter Rentung untuk quality signals dan expert analysis? "
+        "Klik sini: {url}"
+    ),
+    ('registration_suggestion', 'id'): (
+        "{body}\n\n💡 Anda memang aktif bertanya! "
+        "Mau join Group Chat Fighter Rentung untuk sinyal berkualitas dan analisis ahli? "
+        "Klik di sini: {url}"
+    ),
+    ('registration_suggestion', 'en'): (
+        "{body}\n\n💡 You're really engaged with learning! "
+        "Want to join our Group Chat Fighter Rentung for quality signals and expert analysis? "
+        "Click here: {url}"
+    ),
+    ('ai_unavailable', 'ms'): (
+        "Maaf awak, saya ada masalah dengan AI system sekarang. "
+        "Boleh try tanya lagi atau tanya soalan yang specific pasal forex?"
+    ),
+    ('ai_unavailable', 'id'): (
+        "Maaf, saya ada masalah dengan sistem AI sekarang. "
+        "Bisa coba tanya lagi atau tanya pertanyaan spesifik tentang forex?"
+    ),
+    ('ai_unavailable', 'en'): (
+        "Sorry, I'm having trouble with the AI system right now. "
+        "Please try asking again or ask a specific forex question."
+    ),
+    ('ai_missing_key', 'ms'): "Maaf, saya ada technical issue. Boleh cuba lagi nanti?",
+    ('ai_missing_key', 'id'): "Maaf, saya ada masalah teknis. Bisa coba lagi nanti?",
+    ('ai_missing_key', 'en'): "Sorry, I'm having technical issues. Please try again later.",
+    ('live_agent', 'ms'): (
+        "Soalan awak ni memerlukan expertise dari agent sebenar! 🧑‍💼\n\n"
+        "Untuk bantuan lanjutan dengan:\n"
+        "✅ Analisis teknikal mendalam\n"
+        "✅ Strategi trading khusus\n"
+        "✅ Setup akaun Valetax\n\n"
+        "Sila type /agent untuk disambungkan dengan agent kami yang berpengalaman!"
+    ),
+    ('live_agent', 'id'): (
+        "Pertanyaan Anda memerlukan keahlian dari agen sungguhan! 🧑‍💼\n\n"
+        "Untuk bantuan lanjutan dengan:\n"
+        "✅ Analisis teknikal mendalam\n"
+        "✅ Strategi trading khusus\n"
+        "✅ Setup akun Valetax\n\n"
+        "Silakan ketik /agent untuk terhubung dengan agen berpengalaman kami!"
+    ),
+    ('live_agent', 'en'): (
+        "Your question requires expertise from a real agent! 🧑‍💼\n\n"
+        "For advanced help with:\n"
+        "✅ In-depth technical analysis\n"
+        "✅ Specific trading strategies\n"
+        "✅ Valetax account setup\n\n"
+        "Please type /agent to connect with our experienced agents!"
+    ),
+    ('ai_error', 'ms'): (
+        "Maaf awak, saya ada masalah sikit sekarang nak process soalan ni. "
+        "Boleh try tanya lagi ke atau tanya soalan lain?"
+    ),
+    ('ai_error', 'id'): (
+        "Maaf, saya ada masalah sedikit sekarang untuk proses pertanyaan ini. "
+        "Bisa coba tanya lagi atau tanya pertanyaan lain?"
+    ),
+    ('ai_error', 'en'): (
+        "I'm having trouble processing your request right now. "
+        "Please try again or feel free to ask another question."
+    ),
+    ('broker_general', 'ms'): (
+        "Boleh je! Saya ada info pasal broker macam OctaFX, HFM, Valetax, dan Dollars Markets. "
+        "Tanya je pasal spread, leverage, regulation, atau nak compare broker mana-mana pun!"
+    ),
+    ('broker_general', 'id'): (
+        "Bisa dong! Saya punya info tentang broker seperti OctaFX, HFM, Valetax, dan Dollars Markets. "
+        "Tanya aja tentang spread, leverage, regulasi, atau mau compare broker mana pun!"
+    ),
+    ('broker_general', 'en'): (
+        "I can help you with information about brokers like OctaFX, HFM, Valetax, and Dollars Markets. "
+        "Ask me about spreads, leverage, regulation, or compare these brokers!"
+    ),
+}
+
+
+# Registration links are HS256 JWTs with a fixed header, so the header
+# segment is encoded once and only the payload is signed per link.
+_JWT_HEADER_SEGMENT: Final[bytes] = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+
+
+def _encode_hs256(payload: Dict, signer: hmac.HMAC) -> str:
+    """Encode a JWT signed with HS256, compatible with jwt.decode
+
+    signer is an HMAC-SHA256 already keyed with the secret; it is copied, so
+    the key schedule is computed once rather than per token.
+    """
+    payload_segment = base64.urlsafe_b64encode(
+        json.dumps(payload, separators=(',', ':')).encode()
+    ).rstrip(b'=')
+    signing_input = _JWT_HEADER_SEGMENT + b'.' + payload_segment
+    mac = signer.copy()
+    mac.update(signing_input)
+    signature = base64.urlsafe_b64encode(mac.digest()).rstrip(b'=')
+    return (signing_input + b'.' + signature).decode()
+
+
+def _render_broker_summary(broker_info: Dict, language: str) -> str:
+    """Render the single-broker answer used by handle_broker_inquiry"""
+    regulators = ', '.join(broker_info['regulation']['primary_regulators'])
+    min_deposit = next(iter(broker_info['trading_conditions']['account_types'].values()))['minimum_deposit']
+    max_leverage = broker_info['trading_conditions']['maximum_leverage']
+    platforms = ', '.join(broker_info['platforms_tools']['trading_platforms'])
+
+    if language == 'ms':
+        # Use the comprehensive overview for detailed broker information
+        if 'overview' in broker_info and len(broker_info['overview']) > 100:
+            parts = [f"**{broker_info['name']}:**\n\n{broker_info['overview']}\n\n"]
+        else:
+            # Fallback to short format if no detailed overview
+            parts = [
+                f"**Maklumat {broker_info['name']}:**\n\n"
+                f"**Peraturan:** {regulators}\n"
+                f"**Deposit Minimum:** {min_deposit}\n"
+                f"**Leverage Maksimum:** {max_leverage}\n"
+                f"**Platform:** {platforms}\n\n"
+            ]
+        warnings_heading = "**⚠️ AMARAN PENTING:**\n"
+    else:
+        parts = [
+            f"**{broker_info['name']} Information:**\n\n"
+            f"**Regulation:** {regulators}\n"
+            f"**Minimum Deposit:** {min_deposit}\n"
+            f"**Maximum Leverage:** {max_leverage}\n"
+            f"**Platforms:** {platforms}\n\n"
+        ]
+        warnings_heading = "**⚠️ CRITICAL WARNINGS:**\n"
+    # Add warnings for risky brokers
+    if 'major_warnings' in broker_info:
+        parts.append(warnings_heading)
+        parts.extend(f"• {warning}\n" for warning in broker_info['major_warnings'])
+    return ''.join(parts)
+
+
+# Broker profiles are static, so each (broker, language) answer is rendered once
+BROKER_SUMMARIES: Final[Dict[tuple, str]] = {
+    (broker_key, language): _render_broker_summary(broker_info, language)
+    for broker_key, broker_info in BROKER_PROFILES.items()
+    for language in ('ms', 'en')
+}
+
+
+def _format_comparison_ms(comparison: Dict) -> str:
+    """Render a two-broker comparison in Malay"""
+    broker1, broker2 = comparison['broker1'], comparison['broker2']
+    return (
+        f"**Perbandingan {broker1} vs {broker2}:**\n\n"
+        f"**Peraturan:**\n• {broker1}: {', '.join(comparison['regulation']['broker1'])}\n"
+        f"• {broker2}: {', '.join(comparison['regulation']['broker2'])}\n\n"
+        f"**Deposit Minimum:**\n• {broker1}: {comparison['min_deposit']['broker1']}\n"
+        f"• {broker2}: {comparison['min_deposit']['broker2']}\n\n"
+        f"**Platform:**\n• {broker1}: {', '.join(comparison['platforms']['broker1'])}\n"
+        f"• {broker2}: {', '.join(comparison['platforms']['broker2'])}"
+    )
+
+
+def _format_comparison_en(comparison: Dict) -> str:
+    """Render a two-broker comparison in English"""
+    broker1, broker2 = comparison['broker1'], comparison['broker2']
+    return (
+        f"**{broker1} vs {broker2} Comparison:**\n\n"
+        f"**Regulation:**\n• {broker1}: {', '.join(comparison['regulation']['broker1'])}\n"
+        f"• {broker2}: {', '.join(comparison['regulation']['broker2'])}\n\n"
+        f"**Minimum Deposit:**\n• {broker1}: {comparison['min_deposit']['broker1']}\n"
+        f"• {broker2}: {comparison['min_deposit']['broker2']}\n\n"
+        f"**Platforms:**\n• {broker1}: {', '.join(comparison['platforms']['broker1'])}\n"
+        f"• {broker2}: {', '.join(comparison['platforms']['broker2'])}"
+    )
+
+
+# Other languages fall back to the English comparison
+_COMPARISON_FORMATTERS: Final[Dict[str, Callable[[Dict], str]]] = {
+    'ms': _format_comparison_ms,
+    'en': _format_comparison_en,
+}
+
+# Every broker pair is compared once at import, as with BROKER_SUMMARIES
+_COMPARISON_REPLIES: Final[Dict[tuple, str]] = {
+    (broker1, broker2, language): formatter(compare_brokers(broker1, broker2))
+    for broker1 in BROKER_PROFILES
+    for broker2 in BROKER_PROFILES
+    for language, formatter in _COMPARISON_FORMATTERS.items()
+}
+
+
+# Keyword tables are static, so they are compiled once and shared by every engine
+_BROKER_KEYWORDS: Final = (
+    'valetax', 'valet tax', 'broker', 'brokers', 'trading platform',
+    'account setup', 'registration', 'deposit', 'withdrawal',
+    'spread', 'leverage', 'minimum deposit', 'platform', 'mt4', 'mt5',
+    'fsc', 'regulated', 'trading conditions', 'account types'
+)
+_BROKER_KEYWORDS_RE: Final = _compile_any(_BROKER_KEYWORDS)
+# Strategy/"best trading" questions, keywords in any order
+_COMPLEX_Q_RE: Final = re.compile(
+    r"^(?=.*how to)(?=.*(?:strategy|trade))|^(?=.*what is the best)(?=.*trading)",
+    re.DOTALL
+)
+# (keyword, broker) pairs, most frequently mentioned keywords first
+_BROKER_MAPPINGS: Final = (
+    ('broker', 'valetax'),  # Default broker mentions to Valetax
+    ('valetax', 'valetax'),
+    ('trading platform', 'valetax'),
+    ('valet tax', 'valetax'),
+)
+
+
+def _compile_broker_patterns(mappings) -> tuple:
+    """One pattern per broker over all of its keywords"""
+    keywords_by_broker = {}
+    for keyword, broker_key in mappings:
+        keywords_by_broker.setdefault(broker_key, []).append(keyword)
+    return tuple((broker_key, _compile_any(keywords)) for broker_key, keywords in keywords_by_broker.items())
+
+
+_BROKER_PATTERNS: Final = _compile_broker_patterns(_BROKER_MAPPINGS)
+
+
 class ConversationEngine:
+    # Fixed attribute layout: no per-instance __dict__ and faster attribute reads
+    __slots__ = (
+        'openai_client', '_api_key_valid', 'base_url', 'jwt_secret_key', '_jwt_signer',
+        '_openai_sem', '_response_cache', '_link_cache', '_context_summaries',
+        '_classify_cache', '_broker_reply_cache', '_inflight', '_intent_handlers',
+    )
+
+    # Only keep broker keywords for broker inquiry detection
+    broker_keywords = _BROKER_KEYWORDS
+
     def __init__(self):
-        print("🚀 Initializing ConversationEngine...")
+        logger.info("🚀 Initializing ConversationEngine...")
         api_key = os.getenv('OPENAI_API_KEY')
+        self._api_key_valid = bool(api_key)
         if not api_key:
-            print("❌ ERROR: OPENAI_API_KEY not found in environment variables")
+            logger.error("❌ OPENAI_API_KEY not found in environment variables")
             self.openai_client = None
         else:
-            print(f"🔑 Initializing OpenAI client with API key: {api_key[:8]}...")
+            logger.info("🔑 Initializing OpenAI client with API key: %s...", api_key[:8])
             try:
-                self.openai_client = AsyncOpenAI(api_key=api_key)
-                print("✅ OpenAI client initialized successfully")
+                # The SDK retries 429s and 5xx itself with exponential backoff
+                self.openai_client = AsyncOpenAI(
+                    api_key=api_key,
+                    max_retries=_OPENAI_MAX_RETRIES,
+                    timeout=_OPENAI_TIMEOUT,
+                    http_client=(
+                        DefaultAioHttpClient() if DefaultAioHttpClient is not None
+                        # Sized to the completion semaphore so idle keep-alive sockets are reused
+                        else openai.DefaultAsyncHttpxClient(limits=httpx.Limits(
+                            max_connections=_OPENAI_CONCURRENCY * 2,
+                            max_keepalive_connections=_OPENAI_CONCURRENCY
+                        ))
+                    )
+                )
+                if DefaultAioHttpClient is None:
+                    logger.info("aiohttp not installed, OpenAI client using a pooled httpx transport")
+                logger.info("✅ OpenAI client initialized successfully")
             except Exception as e:
-                print(f"❌ Failed to initialize OpenAI client: {e}")
+                logger.error("❌ Failed to initialize OpenAI client: %s", e)
                 self.openai_client = None
+        # Caps in-flight completions so concurrent users overlap on the wire
+        # without blowing through the account's rate limit; excess calls queue
+        self._openai_sem = asyncio.Semaphore(_OPENAI_CONCURRENCY)
+        # cache key -> (monotonic timestamp, response), oldest first
+        self._response_cache = OrderedDict()
+        # (telegram_id, username) -> (monotonic timestamp, registration url), oldest first
+        self._link_cache = OrderedDict()
+        # sha256 of a long conversation context -> its summary, oldest first
+        self._context_summaries = OrderedDict()
+        # lowercased short message -> (language, intent), oldest first
+        self._classify_cache = OrderedDict()
+        # (lowercased short message, language) -> broker answer, oldest first
+        self._broker_reply_cache = OrderedDict()
+        # response cache key -> completion task shared by identical concurrent questions
+        self._inflight = {}
+        # intent -> reply handler; anything unlisted goes to the AI conversation
+        self._intent_handlers = {
+            'registration': self._handle_registration,
+            'indicator_registration': self._handle_indicator_registration,
+            'broker_inquiry': self._handle_broker_intent,
+        }
 
         # Registration API configuration (using built-in system)
         self.base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
         self.jwt_secret_key = os.getenv('JWT_SECRET_KEY')
+        self._jwt_signer = hmac.new((self.jwt_secret_key or '').encode(), digestmod=hashlib.sha256)
 
         if not self.jwt_secret_key:
-            print("WARNING: JWT_SECRET_KEY not found in environment variables")
-        # Only keep broker keywords for broker inquiry detection
-        self.broker_keywords = [
-            'valetax', 'valet tax', 'broker', 'brokers', 'trading platform', 
-            'account setup', 'registration', 'deposit', 'withdrawal',
-            'spread', 'leverage', 'minimum deposit', 'platform', 'mt4', 'mt5',
-            'fsc', 'regulated', 'trading conditions', 'account types'
-        ]
+            logger.warning("JWT_SECRET_KEY not found in environment variables")
         # FAQ responses removed - now handled by AI for natural conversation
 
         # Malay FAQ responses also removed - handled by AI
 
-    def detect_language(self, message: str) -> str:
+    async def aclose(self) -> None:
+        """Close the OpenAI client's pooled connections"""
+        if self.openai_client is not None:
+            await self.openai_client.close()
+
+    def detect_language(self, message: str, ctx: _MessageCtx = None) -> str:
         """Detect language from user message - supports English, Bahasa Malaysia, and Bahasa Indonesia"""
-        message_lower = message.lower()
+        if ctx is None:
+            ctx = _MessageCtx.of(message)
+        message_lower = ctx.lower
         
-        # Indonesian specific words and patterns
-        indonesian_keywords = [
-            'saya', 'aku', 'kamu', 'anda', 'dengan', 'untuk', 'dari', 'yang', 'ini', 'itu',
-            'bisa', 'tidak', 'nggak', 'sudah', 'belum', 'bagaimana', 'mengapa', 'kenapa',
-            'dimana', 'kapan', 'siapa', 'mau', 'ingin', 'butuh', 'perlu', 'belajar',
-            'trading', 'forex', 'rupiah', 'investasi', 'saham', 'broker', 'platform',
-            'gimana', 'dong', 'nih', 'deh', 'sih', 'banget', 'emang'
-        ]
-        
-        # Malaysian specific words and patterns  
-        malaysian_keywords = [
-            'saya', 'aku', 'awak', 'kamu', 'dengan', 'untuk', 'dari', 'yang', 'ini', 'itu',
-            'boleh', 'tak', 'tak boleh', 'sudah', 'belum', 'macam mana', 'mengapa', 'kenapa',
-            'kat mana', 'bila', 'siapa', 'nak', 'mau', 'hendak', 'perlukan', 'belajar',
-            'trading', 'forex', 'ringgit', 'pelaburan', 'saham', 'broker', 'platform',
-            'lah', 'leh', 'la', 'ke', 'jer', 'je', 'kan', 'gak', 'tak'
-        ]
-        
-        # English keywords
-        english_keywords = [
-            'i', 'you', 'me', 'my', 'your', 'with', 'for', 'from', 'that', 'this',
-            'can', 'cannot', 'could', 'would', 'should', 'will', 'have', 'has', 'had',
-            'how', 'what', 'why', 'when', 'where', 'who', 'want', 'need', 'learn',
-            'trading', 'forex', 'dollar', 'investment', 'stock', 'broker', 'platform',
-            'the', 'and', 'or', 'but', 'so', 'because', 'if', 'then', 'than'
-        ]
-        
-        # Count matches for each language
-        indonesian_score = sum(1 for word in indonesian_keywords if word in message_lower)
-        malaysian_score = sum(1 for word in malaysian_keywords if word in message_lower)
-        english_score = sum(1 for word in english_keywords if word in message_lower)
-        
-        # Check for specific language indicators
-        if any(indicator in message_lower for indicator in ['gimana', 'dong', 'nih', 'banget', 'emang', 'nggak', 'bisa', 'rupiah']):
+        # Check for specific language indicators (whole words)
+        tokens = ctx.tokens
+        if not _ID_INDICATORS.isdisjoint(tokens):
             return 'id'  # Indonesian
-        elif any(indicator in message_lower for indicator in ['lah', 'leh', 'jer', 'je', 'nak', 'kat mana', 'ringgit', 'boleh']):
+        elif not _MS_INDICATORS.isdisjoint(tokens) or 'kat mana' in message_lower:
             return 'ms'  # Malaysian
-        elif any(indicator in message_lower for indicator in ['the ', ' and ', ' or ', ' but ', 'dollar', 'cannot']):
+        elif not _EN_INDICATORS.isdisjoint(tokens):
             return 'en'  # English
-            
+
+        # Count keyword matches for each language; Malay/Indonesian shared words count for both
+        shared_score, indonesian_only, malaysian_only, english_score = _language_keyword_scores(message_lower)
+        indonesian_score = shared_score + indonesian_only
+        malaysian_score = shared_score + malaysian_only
+
         # Determine language based on highest score
         if indonesian_score > malaysian_score and indonesian_score > english_score:
             return 'id'
@@ -99,244 +1069,169 @@ class ConversationEngine:
         else:
             return 'ms'  # Default to Malaysian if no clear indicators
 
-    def needs_live_agent(self, message: str) -> bool:
+    def needs_live_agent(self, message: str, ctx: _MessageCtx = None) -> bool:
         """Detect if question requires live agent intervention"""
-        message_lower = message.lower()
-        
-        # Technical analysis keywords
-        technical_keywords = [
-            'fibonacci retracement', 'elliott wave', 'harmonic pattern', 'divergence analysis',
-            'ichimoku cloud', 'bollinger band', 'rsi divergence', 'macd histogram',
-            'pivot point calculation', 'stochastic oscillator', 'williams %r',
-            'market structure', 'price action', 'volume profile', 'order flow',
-            'scalping strategy', 'day trading', 'swing trading', 'position sizing',
-            'correlation analysis', 'carry trade', 'hedging strategy',
-            'news trading', 'economic calendar', 'fundamental analysis'
-        ]
-        
-        # Advanced trading concepts
-        advanced_keywords = [
-            'algorithmic trading', 'expert advisor', 'automated trading',
-            'backtesting', 'forward testing', 'optimization',
-            'risk management', 'portfolio management', 'money management',
-            'drawdown', 'sharpe ratio', 'risk-reward ratio',
-            'margin call', 'stop out', 'margin requirement',
-            'slippage', 'requote', 'spread widening'
-        ]
-        
-        # Live agent request keywords
-        agent_request_keywords = [
-            'live agent', 'human agent', 'real person', 'customer service',
-            'support team', 'help desk', 'representative', 'advisor',
-            'agent sebenar', 'manusia sebenar', 'customer support',
-            'nak cakap dengan orang', 'minta tolong staff', 'agent bantuan',
-            'agen sungguhan', 'manusia asli', 'customer support',
-            'mau bicara dengan orang', 'minta tolong staff', 'agen bantuan'
-        ]
-        
-        # Check for any technical keywords
-        all_keywords = technical_keywords + advanced_keywords + agent_request_keywords
-        
-        for keyword in all_keywords:
-            if keyword in message_lower:
-                return True
-                
+        message_lower = ctx.lower if ctx is not None else message.lower()
+
+        if _LIVE_AGENT_RE.search(message_lower):
+            return True
+
         # Check for complex question patterns (multiple questions, specific strategy requests)
-        if ('how to' in message_lower and ('strategy' in message_lower or 'trade' in message_lower)) or \
-           ('what is the best' in message_lower and 'trading' in message_lower) or \
-           len(message.split()) > 50:  # Very long questions
+        if _COMPLEX_Q_RE.search(message_lower) or \
+           message.count(' ') > 50:  # Very long questions
             return True
             
         return False
 
-    def is_forex_related(self, message: str) -> bool:
+    def is_forex_related(self, message: str, ctx: _MessageCtx = None) -> bool:
         """Check if message is forex/trading related"""
-        forex_terms = [
-            'forex', 'trading', 'currency', 'pair', 'pip', 'spread', 'leverage', 'margin',
-            'broker', 'chart', 'analysis', 'technical', 'fundamental', 'support', 'resistance',
-            'trend', 'bull', 'bear', 'long', 'short', 'buy', 'sell', 'profit', 'loss',
-            'strategy', 'scalping', 'swing', 'position', 'market', 'exchange', 'rate',
-            # Malaysian terms
-            'mata wang', 'perdagangan', 'pasaran', 'analisis', 'strategi', 'keuntungan',
-            'kerugian', 'broker', 'carta', 'teknikal', 'asas', 'sokongan', 'rintangan',
-            'rugi', 'untung', 'trade', 'handle loss', 'manage risk', 'stop loss',
-            # Indonesian terms
-            'mata uang', 'perdagangan', 'pasar', 'analisis', 'strategi', 'keuntungan',
-            'kerugian', 'broker', 'grafik', 'teknikal', 'fundamental', 'dukungan', 'perlawanan',
-            'rugi', 'untung', 'trade', 'kelola kerugian', 'manajemen risiko', 'stop loss'
-        ]
-
-        message_lower = message.lower()
-
-        # Check for trading context phrases
-        trading_phrases = [
-            # English phrases
-            'learn trade', 'learn trading', 'handle loss', 'manage loss', 'trading loss',
-            'how to trade', 'trading tips', 'risk management',
-            # Malaysian phrases
-            'nak belajar trade', 'belajar trading', 'loss dalam trading',
-            'macam mana nak', 'cara nak trade', 'tips trading',
-            # Indonesian phrases
-            'belajar trading', 'belajar trade', 'loss dalam trading',
-            'gimana cara', 'bagaimana cara', 'cara trading', 'tips trading'
-        ]
+        return _FOREX_TERMS_RE.search(ctx.lower if ctx is not None else message.lower()) is not None
 
-        # Check both individual terms and phrases
-        return (any(term in message_lower for term in forex_terms) or 
-                any(phrase in message_lower for phrase in trading_phrases))
-
-    def is_broker_inquiry(self, message: str) -> bool:
+    def is_broker_inquiry(self, message: str, ctx: _MessageCtx = None) -> bool:
         """Check if message is asking about specific brokers"""
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in self.broker_keywords)
-
-    def get_mentioned_brokers(self, message: str) -> list:
-        """Extract broker names mentioned in the message"""
-        message_lower = message.lower()
-        mentioned = []
-
-        broker_mappings = {
-            'valetax': 'valetax',
-            'valet tax': 'valetax',
-            'broker': 'valetax',  # Default broker mentions to Valetax
-            'trading platform': 'valetax'
-        }
+        return _BROKER_KEYWORDS_RE.search(ctx.lower if ctx is not None else message.lower()) is not None
 
-        for keyword, broker_key in broker_mappings.items():
-            if keyword in message_lower:
-                mentioned.append(broker_key)
-
-        return list(set(mentioned))  # Remove duplicates
+    def get_mentioned_brokers(self, message: str, ctx: _MessageCtx = None) -> tuple:
+        """Extract broker names mentioned in the message, in the order they first appear"""
+        message_lower = ctx.lower if ctx is not None else message.lower()
+        positions = {}
+        for broker_key, pattern in _BROKER_PATTERNS:
+            match = pattern.search(message_lower)
+            if match:
+                positions[broker_key] = match.start()
+        if len(positions) < 2:
+            return tuple(positions)
+        return tuple(sorted(positions, key=positions.__getitem__))
 
     async def generate_registration_link(self, telegram_id: str, telegram_username: str = "") -> str:
         """Generate VIP registration link using built-in system"""
+        cache_key = (str(telegram_id), telegram_username or '')
+        cached = self._link_cache.get(cache_key)
+        if cached is not None and time.monotonic() - cached[0] < _LINK_CACHE_TTL_SECONDS:
+            return cached[1]
         try:
-            import jwt
-            from datetime import datetime, timedelta
-            
             # Generate JWT token for registration
+            now = int(time.time())
             payload = {
                 'telegram_id': str(telegram_id),
                 'telegram_username': telegram_username or '',
-                'exp': datetime.utcnow() + timedelta(minutes=30),
-                'iat': datetime.utcnow()
+                'exp': now + _LINK_TOKEN_TTL_SECONDS,
+                'iat': now
             }
             
             if not self.jwt_secret_key:
-                print("❌ JWT_SECRET_KEY not configured, cannot generate registration link")
+                logger.error("❌ JWT_SECRET_KEY not configured, cannot generate registration link")
                 return "error"
             
-            token = jwt.encode(payload, self.jwt_secret_key, algorithm='HS256')
+            token = _encode_hs256(payload, self._jwt_signer)
             registration_url = f"{self.base_url}/?token={token}"
+            self._link_cache[cache_key] = (time.monotonic(), registration_url)
+            self._link_cache.move_to_end(cache_key)
+            if len(self._link_cache) > _LINK_CACHE_MAX_ENTRIES:
+                self._link_cache.popitem(last=False)
             
-            print(f"✅ Generated registration link for user {telegram_id}")
+            logger.debug("✅ Generated registration link for user %s", telegram_id)
             return registration_url
             
         except Exception as e:
-            print(f"❌ Failed to generate registration link: {e}")
+            logger.error("❌ Failed to generate registration link: %s", e)
             return "error"
 
     async def detect_intent(self, message: str) -> str:
         """Simplified intent detection - only 4 core intents"""
-        message_lower = message.lower()
+        return self._detect_intent(message)
+
+    def _detect_intent(self, message: str, ctx: _MessageCtx = None) -> str:
+        """Synchronous body of detect_intent, safe to run in a worker thread"""
+        if ctx is None:
+            ctx = _MessageCtx.of(message)
+        message_lower = ctx.lower
         
         # Priority 1: Check for indicator registration intent
-        indicator_keywords = [
-            'indicator', 'indikator', 'high level', 'engulfing', 'engulfing indicator',
-            'rentungfx indicator', 'trading indicator', 'mt4 indicator', 'mt5 indicator',
-            'custom indicator', 'price action indicator', 'signal indicator'
-        ]
-        
-        if any(keyword in message_lower for keyword in indicator_keywords):
-            # Check if it's related to registration/access
-            if any(reg_word in message_lower for reg_word in ['register', 'daftar', 'access', 'get', 'download', 'dapat', 'nak', 'want', 'mau', 'ingin']):
-                return 'indicator_registration'
-        
+        if _INDICATOR_RE.search(message_lower) and _INDICATOR_ACTION_RE.search(message_lower):
+            return 'indicator_registration'
+
         # Priority 2: Check for general registration intent (VIP/Channel)
-        registration_keywords = [
-            'register', 'daftar', 'join', 'signup', 'sign up', 'masuk', 'sertai',
-            'vip', 'channel', 'premium', 'member', 'membership', 'ahli'
-        ]
-        
-        if any(keyword in message_lower for keyword in registration_keywords):
+        if _REGISTRATION_RE.search(message_lower):
             return 'registration'
         
         # Priority 3: Check for specific broker inquiries with multiple brokers mentioned
-        if self.is_broker_inquiry(message):
-            mentioned_brokers = self.get_mentioned_brokers(message)
-            if len(mentioned_brokers) >= 1:  # If any specific broker is mentioned
+        if self.is_broker_inquiry(message, ctx):
+            if self.get_mentioned_brokers(message, ctx):  # If any specific broker is mentioned
                 return 'broker_inquiry'
         
         # Priority 4: Everything else goes to AI conversation (includes greetings, FAQ, forex, general)
         return 'ai_conversation'
 
+    def _classify(self, message: str, ctx: _MessageCtx) -> tuple:
+        """Detect (language, intent) for a message; pure and lock-free"""
+        return self.detect_language(message, ctx), self._detect_intent(message, ctx)
+
+    def _classify_cached(self, message: str, ctx: _MessageCtx) -> tuple:
+        """_classify memoized for short messages; only ever called on the event loop"""
+        if len(ctx.lower) > _CLASSIFY_CACHE_MAX_CHARS:
+            return self._classify(message, ctx)
+        result = self._classify_cache.get(ctx.lower)
+        if result is not None:
+            self._classify_cache.move_to_end(ctx.lower)
+            return result
+        result = self._classify_cache[ctx.lower] = self._classify(message, ctx)
+        if len(self._classify_cache) > _CLASSIFY_CACHE_MAX_ENTRIES:
+            self._classify_cache.popitem(last=False)
+        return result
+
+    async def classify(self, message: str, ctx: _MessageCtx = None) -> tuple:
+        """Detect (language, intent) from one shared scan of the message
+
+        Runs on the event loop, offloading only unusually long messages.
+        """
+        if ctx is None:
+            ctx = _MessageCtx.of(message)
+        if len(message) > _OFFLOAD_THRESHOLD_CHARS:
+            return await asyncio.to_thread(self._classify, message, ctx)
+        return self._classify_cached(message, ctx)
+
     # FAQ handling removed - now handled by AI for natural conversation
 
     def get_specific_broker_answer(self, broker: str, query_type: str, language: str = 'en') -> str:
         """Get specific answer for broker queries"""
-        if broker in BROKER_QA_PAIRS and query_type in BROKER_QA_PAIRS[broker]:
-            qa_data = BROKER_QA_PAIRS[broker][query_type]
-            return qa_data[f'answer_{language}'] if f'answer_{language}' in qa_data else qa_data['answer_en']
-        return None
+        return _QA_INDEX.get((broker, query_type, language if language in _LANGUAGES else 'en'))
 
-    def detect_query_type(self, message: str) -> str:
+    def detect_query_type(self, message: str, ctx: _MessageCtx = None) -> str:
         """Detect what type of information user is asking about"""
-        message_lower = message.lower()
-
-        if any(word in message_lower for word in ['spread', 'pip', 'eur/usd', 'eurusd']):
-            return 'spreads'
-        elif any(word in message_lower for word in ['minimum deposit', 'min deposit', 'deposit']):
-            return 'minimum_deposit'
-        elif any(word in message_lower for word in ['mt5', 'mt4', 'metatrader', 'platform']):
-            return 'platforms'
-        elif any(word in message_lower for word in ['regulated', 'regulation', 'license', 'safe']):
-            return 'regulation'
-        elif any(word in message_lower for word in ['leverage', 'margin']):
-            return 'leverage'
-        elif any(word in message_lower for word in ['warning', 'risk', 'problem', 'issue']):
-            return 'warnings'
-        elif any(word in message_lower for word in ['beginner', 'new', 'start', 'pemula']):
-            return 'beginner_recommendation'
-        elif any(word in message_lower for word in ['scalping', 'scalp']):
-            return 'scalping_recommendation'
-        elif any(word in message_lower for word in ['professional', 'high volume', 'volume tinggi']):
-            return 'professional_recommendation'
+        message_lower = ctx.lower if ctx is not None else message.lower()
+
+        # Each hit reports the highest-priority category starting at that
+        # position, so the lowest priority seen across the scan wins
+        best_priority = len(_QUERY_TYPE_KEYWORDS)
+        for match in _QUERY_TYPE_RE.finditer(message_lower):
+            priority = _QUERY_TYPE_PRIORITY[match.lastgroup]
+            if priority < best_priority:
+                best_priority = priority
+                if priority == 0:
+                    break
+
+        if best_priority < len(_QUERY_TYPE_KEYWORDS):
+            return _QUERY_TYPE_KEYWORDS[best_priority][0]
 
         return 'general'
 
-    async def handle_broker_inquiry(self, message: str, language: str = 'en') -> str:
+    async def handle_broker_inquiry(self, message: str, language: str = 'en', ctx: _MessageCtx = None) -> str:
         """Handle broker-specific inquiries"""
-        mentioned_brokers = self.get_mentioned_brokers(message)
-        message_lower = message.lower()
-        query_type = self.detect_query_type(message)
+        if ctx is None:
+            ctx = _MessageCtx.of(message)
+        mentioned_brokers = self.get_mentioned_brokers(message, ctx)
+        message_lower = ctx.lower
+        query_type = self.detect_query_type(message, ctx)
 
         # Handle scenario-based recommendations
         if query_type in ['beginner_recommendation', 'scalping_recommendation', 'professional_recommendation']:
             scenario_key = query_type.replace('_recommendation', '_trader')
-            if scenario_key in SCENARIO_RECOMMENDATIONS:
-                scenario = SCENARIO_RECOMMENDATIONS[scenario_key]
-                title = scenario[f'title_{language}'] if f'title_{language}' in scenario else scenario['title_en']
-
-                response = f"**{title}**\n\n"
-
-                if '1st_choice' in scenario['recommendations']:
-                    choice = scenario['recommendations']['1st_choice']
-                    reasons_key = f'reasons_{language}' if f'reasons_{language}' in choice else 'reasons_en'
-
-                    response += f"**🥇 {choice['broker']}:**\n"
-                    for reason in choice[reasons_key]:
-                        response += f"• {reason}\n"
-                    response += "\n"
-
-                if '2nd_choice' in scenario['recommendations']:
-                    choice = scenario['recommendations']['2nd_choice']
-                    reasons_key = f'reasons_{language}' if f'reasons_{language}' in choice else 'reasons_en'
-
-                    response += f"**🥈 {choice['broker']}:**\n"
-                    for reason in choice[reasons_key]:
-                        response += f"• {reason}\n"
-
-                return response
+            scenario_response = _SCENARIO_RESPONSES.get(
+                (scenario_key, language if language in _LANGUAGES else 'en')
+            )
+            if scenario_response is not None:
+                return scenario_response
 
         # Handle specific broker questions
         if len(mentioned_brokers) == 1 and query_type != 'general':
@@ -346,582 +1241,309 @@ class ConversationEngine:
                 return specific_answer
 
         # If comparing brokers
-        if ('compare' in message_lower or 'comparison' in message_lower or 'vs' in message_lower) and len(mentioned_brokers) >= 2:
-            broker1, broker2 = mentioned_brokers[0], mentioned_brokers[1]
-            comparison = compare_brokers(broker1, broker2)
-
+        if len(mentioned_brokers) >= 2 and _COMPARE_RE.search(message_lower):
+            comparison = _COMPARISON_REPLIES.get((
+                mentioned_brokers[0].lower().replace(' ', '_'),
+                mentioned_brokers[1].lower().replace(' ', '_'),
+                'ms' if language == 'ms' else 'en'
+            ))
             if comparison:
-                if language == 'ms':
-                    response = f"**Perbandingan {comparison['broker1']} vs {comparison['broker2']}:**\n\n"
-                    response += f"**Peraturan:**\n• {comparison['broker1']}: {', '.join(comparison['regulation']['broker1'])}\n"
-                    response += f"• {comparison['broker2']}: {', '.join(comparison['regulation']['broker2'])}\n\n"
-                    response += f"**Deposit Minimum:**\n• {comparison['broker1']}: {comparison['min_deposit']['broker1']}\n"
-                    response += f"• {comparison['broker2']}: {comparison['min_deposit']['broker2']}\n\n"
-                    response += f"**Platform:**\n• {comparison['broker1']}: {', '.join(comparison['platforms']['broker1'])}\n"
-                    response += f"• {comparison['broker2']}: {', '.join(comparison['platforms']['broker2'])}"
-                else:
-                    response = f"**{comparison['broker1']} vs {comparison['broker2']} Comparison:**\n\n"
-                    response += f"**Regulation:**\n• {comparison['broker1']}: {', '.join(comparison['regulation']['broker1'])}\n"
-                    response += f"• {comparison['broker2']}: {', '.join(comparison['regulation']['broker2'])}\n\n"
-                    response += f"**Minimum Deposit:**\n• {comparison['broker1']}: {comparison['min_deposit']['broker1']}\n"
-                    response += f"• {comparison['broker2']}: {comparison['min_deposit']['broker2']}\n\n"
-                    response += f"**Platforms:**\n• {comparison['broker1']}: {', '.join(comparison['platforms']['broker1'])}\n"
-                    response += f"• {comparison['broker2']}: {', '.join(comparison['platforms']['broker2'])}"
-                return response
+                return comparison
 
         # If asking about specific broker
         elif len(mentioned_brokers) == 1:
-            broker_info = get_broker_info(mentioned_brokers[0])
-            if broker_info:
-                if language == 'ms':
-                    # Use the comprehensive overview for detailed broker information
-                    if 'overview' in broker_info and len(broker_info['overview']) > 100:
-                        # Use the detailed overview instead of short format
-                        response = f"**{broker_info['name']}:**\n\n"
-                        response += f"{broker_info['overview']}\n\n"
-                    else:
-                        # Fallback to short format if no detailed overview
-                        response = f"**Maklumat {broker_info['name']}:**\n\n"
-                        response += f"**Peraturan:** {', '.join(broker_info['regulation']['primary_regulators'])}\n"
-                        response += f"**Deposit Minimum:** {list(broker_info['trading_conditions']['account_types'].values())[0]['minimum_deposit']}\n"
-                        response += f"**Leverage Maksimum:** {broker_info['trading_conditions']['maximum_leverage']}\n"
-                        response += f"**Platform:** {', '.join(broker_info['platforms_tools']['trading_platforms'])}\n\n"
-
-                    # Add warnings for risky brokers
-                    if 'major_warnings' in broker_info:
-                        response += "**⚠️ AMARAN PENTING:**\n"
-                        for warning in broker_info['major_warnings']:
-                            response += f"• {warning}\n"
-                else:
-                    response = f"**{broker_info['name']} Information:**\n\n"
-                    response += f"**Regulation:** {', '.join(broker_info['regulation']['primary_regulators'])}\n"
-                    response += f"**Minimum Deposit:** {list(broker_info['trading_conditions']['account_types'].values())[0]['minimum_deposit']}\n"
-                    response += f"**Maximum Leverage:** {broker_info['trading_conditions']['maximum_leverage']}\n"
-                    response += f"**Platforms:** {', '.join(broker_info['platforms_tools']['trading_platforms'])}\n\n"
+            summary_language = 'ms' if language == 'ms' else 'en'
+            broker_key = mentioned_brokers[0].lower().replace(' ', '_')
+            summary = BROKER_SUMMARIES.get((broker_key, summary_language))
+            if summary:
+                return summary
 
-                    # Add warnings for risky brokers
-                    if 'major_warnings' in broker_info:
-                        response += "**⚠️ CRITICAL WARNINGS:**\n"
-                        for warning in broker_info['major_warnings']:
-                            response += f"• {warning}\n"
+        # General broker question without specific broker mentioned
+        return _RESPONSES[('broker_general', language if language in _LANGUAGES else 'en')]
 
-                return response
+    async def _summarize_context(self, conversation_context: str) -> str:
+        """Condense long conversation context, reusing an earlier summary of the same text"""
+        digest = hashlib.sha256(conversation_context.encode()).digest()
+        summary = self._context_summaries.get(digest)
+        if summary is not None:
+            self._context_summaries.move_to_end(digest)
+            return summary
 
-        # General broker question without specific broker mentioned
-        if language == 'ms':
-            return ("Boleh je! Saya ada info pasal broker macam OctaFX, HFM, Valetax, dan Dollars Markets. "
-                   "Tanya je pasal spread, leverage, regulation, atau nak compare broker mana-mana pun!")
-        elif language == 'id':
-            return ("Bisa dong! Saya punya info tentang broker seperti OctaFX, HFM, Valetax, dan Dollars Markets. "
-                   "Tanya aja tentang spread, leverage, regulasi, atau mau compare broker mana pun!")
-        else:
-            return ("I can help you with information about brokers like OctaFX, HFM, Valetax, and Dollars Markets. "
-                   "Ask me about spreads, leverage, regulation, or compare these brokers!")
+        try:
+            async with self._openai_sem:
+                response = await self.openai_client.chat.completions.create(
+                    model=_CONTEXT_SUMMARY_MODEL,
+                    messages=[
+                        {"role": "system", "content": (
+                            "Summarize this conversation history for a forex assistant. Keep the user's "
+                            "goals, experience level, brokers mentioned and open questions. Be brief."
+                        )},
+                        {"role": "user", "content": conversation_context}
+                    ],
+                    max_tokens=_CONTEXT_SUMMARY_MAX_TOKENS,
+                    temperature=0
+                )
+            summary = (response.choices[0].message.content or '').strip() if response.choices else ''
+        except Exception as e:
+            logger.warning("Context summarization failed, truncating instead: %s", e)
+            summary = ''
+
+        if not summary:
+            # Keep the most recent part of the history rather than all of it
+            return conversation_context[-_CONTEXT_SUMMARY_THRESHOLD_CHARS:]
+
+        self._context_summaries[digest] = summary
+        if len(self._context_summaries) > _CONTEXT_SUMMARY_MAX_ENTRIES:
+            self._context_summaries.popitem(last=False)
+        return summary
+
+    async def _stream_completion(self, model: str, messages: List[Dict], max_tokens: int,
+                                 on_partial: Callable[[str], None] = None) -> str:
+        """Run one streamed chat completion and return its text
+
+        on_partial, if given, is called with each text delta as it arrives.
+        """
+        async with self._openai_sem:
+            response = await self.openai_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            # Streamed so decoding overlaps the network instead of
+            # waiting for the whole body
+            parts = []
+            received_choices = False
+            async for chunk in response:
+                if chunk.usage is not None:
+                    # Final chunk; reports how much of the max_tokens budget was used
+                    logger.debug("Completion tokens: %d of %d", chunk.usage.completion_tokens, max_tokens)
+                if not chunk.choices:
+                    continue
+                received_choices = True
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    if on_partial is not None:
+                        on_partial(delta)
 
-    async def generate_ai_response(self, message: str, conversation_context: str = "", language: str = 'en') -> str:
+        if not received_choices:
+            logger.error("No choices in OpenAI response")
+            raise Exception("No choices in OpenAI response")
+
+        ai_response = ''.join(parts)
+        logger.debug("AI response content length: %d", len(ai_response))
+        return ai_response
+
+    def _finish_ai_response(self, ai_response: str, cache_key: tuple, message: str, language: str) -> str:
+        """Cache a model reply, or substitute the fallback when it came back empty"""
+        if not ai_response or ai_response.strip() == "":
+            logger.warning("Empty AI response received for message: %.50s", message)
+            return _RESPONSES[('unanswerable', language if language in _LANGUAGES else 'en')]
+
+        ai_response = ai_response.strip()
+        self._response_cache[cache_key] = (time.monotonic(), ai_response)
+        if len(self._response_cache) > _RESPONSE_CACHE_MAX_ENTRIES:
+            self._response_cache.popitem(last=False)
+        return ai_response
+
+    async def generate_ai_response(self, message: str, conversation_context: str = "", language: str = 'en',
+                                   ctx: _MessageCtx = None, on_partial: Callable[[str], None] = None,
+                                   model: str = None) -> str:
         """Generate AI response using OpenAI GPT-4o"""
         try:
-            print(f"🤖 Generating AI response for: {message[:50]}... | Language: {language}")
+            logger.debug("🤖 Generating AI response for: %.50s... | Language: %s", message, language)
 
             # Check if OpenAI client is properly initialized
             if not self.openai_client:
-                print("❌ ERROR: OpenAI client not initialized")
-                if language == 'ms':
-                    return (
-                        "Maaf awak, saya ada masalah dengan AI system sekarang. "
-                        "Boleh try tanya lagi atau tanya soalan yang specific pasal forex?"
-                    )
-                elif language == 'id':
-                    return (
-                        "Maaf, saya ada masalah dengan sistem AI sekarang. "
-                        "Bisa coba tanya lagi atau tanya pertanyaan spesifik tentang forex?"
-                    )
-                else:
-                    return (
-                        "Sorry, I'm having trouble with the AI system right now. "
-                        "Please try asking again or ask a specific forex question."
-                    )
+                logger.error("❌ OpenAI client not initialized")
+                return _RESPONSES[('ai_unavailable', language if language in _LANGUAGES else 'en')]
                     
-            # Verify API key exists
-            api_key = os.getenv('OPENAI_API_KEY')
-            if not api_key:
-                print("❌ ERROR: OPENAI_API_KEY not found")
-                if language == 'ms':
-                    return "Maaf, saya ada technical issue. Boleh cuba lagi nanti?"
-                elif language == 'id':
-                    return "Maaf, saya ada masalah teknis. Bisa coba lagi nanti?"
-                else:
-                    return "Sorry, I'm having technical issues. Please try again later."
+            # API key presence is checked once in __init__
+            if not self._api_key_valid:
+                logger.error("❌ OPENAI_API_KEY not found")
+                return _RESPONSES[('ai_missing_key', language if language in _LANGUAGES else 'en')]
 
             # Smart context detection
-            is_greeting = any(word in message.lower() for word in ['hello', 'hi', 'hai', 'good morning', 'assalamualaikum', 'selamat', 'start'])
-            is_forex_related = self.is_forex_related(message)
-            needs_agent = self.needs_live_agent(message)
+            if ctx is None:
+                ctx = _MessageCtx.of(message)
+            is_greeting = not _GREETING_WORDS.isdisjoint(ctx.tokens) or 'good morning' in ctx.lower
+            is_forex_related = self.is_forex_related(message, ctx)
+            needs_agent = self.needs_live_agent(message, ctx)
             
             # If user needs live agent, provide immediate redirection
             if needs_agent:
-                if language == 'ms':
-                    return (
-                        "Soalan awak ni memerlukan expertise dari agent sebenar! 🧑‍💼\n\n"
-                        "Untuk bantuan lanjutan dengan:\n"
-                        "✅ Analisis teknikal mendalam\n"
-                        "✅ Strategi trading khusus\n"
-                        "✅ Setup akaun Valetax\n\n"
-                        "Sila type /agent untuk disambungkan dengan agent kami yang berpengalaman!"
-                    )
-                elif language == 'id':
-                    return (
-                        "Pertanyaan Anda memerlukan keahlian dari agen sungguhan! 🧑‍💼\n\n"
-                        "Untuk bantuan lanjutan dengan:\n"
-                        "✅ Analisis teknikal mendalam\n"
-                        "✅ Strategi trading khusus\n"
-                        "✅ Setup akun Valetax\n\n"
-                        "Silakan ketik /agent untuk terhubung dengan agen berpengalaman kami!"
-                    )
-                else:
-                    return (
-                        "Your question requires expertise from a real agent! 🧑‍💼\n\n"
-                        "For advanced help with:\n"
-                        "✅ In-depth technical analysis\n"
-                        "✅ Specific trading strategies\n" 
-                        "✅ Valetax account setup\n\n"
-                        "Please type /agent to connect with our experienced agents!"
-                    )
-            mentioned_brokers = self.get_mentioned_brokers(message)
-            
-            # Build context-aware prompts
-            if language == 'ms':
-                system_prompt = (
-                    "Kau ni RentungBot_Ai - assistant pintar yang pakar dalam broker Valetax dan trading! "
-                    "Jawab dalam Bahasa Malaysia yang natural macam cakap dengan kawan baik. "
-                    "Pakai 'awak', 'lah', 'je', 'kan', 'tak' naturally dalam conversation. "
-                    
-                    "PERSONALITY: Friendly, knowledgeable, helpful, encouraging tapi realistic pasal risks. "
-                    "CONTEXT MALAYSIA: "
-                    "- Guna RM (ringgit) sebagai currency reference "
-                    "- Sebut payment methods local: online banking, TNG eWallet, FPX "
-                    "- Malaysian trading hours: 4PM-1AM (London session terbaik) "
-                    "- Bank Negara Malaysia untuk regulation reference "
-                    "- EPF, KWSP, salary ranges RM2k-5k untuk relatable examples "
-                    "- Consider M40/B40 income levels dan priorities "
-                    
-                    "TRADING APPROACH: "
-                    "- Start small (RM100-500 untuk beginner) "
-                    "- Risk management FIRST (max 1-2% per trade) "
-                    "- Demo account practice essential "
-                    "- Selalu mention importance of stop loss "
-                    "- Recommend Valetax sebagai broker pilihan dengan leverage tinggi dan deposit rendah "
-                    
-                    "CONVERSATION STYLE: "
-                    "- Jawab soalan dengan detail yang helpful "
-                    "- Guna examples yang relatable untuk Malaysian context "
-                    "- Mix BM dengan common English trading terms naturally "
-                    "- If tanya complex stuff, break down step by step "
-                    "- ALWAYS end setiap response dengan: 'Nak berbual dengan agent sebenar? Type /agent' "
-                    "- Keep responses CONCISE - match user's message length (short questions = short answers) "
-                )
-                
-                # Add specific context based on message content
-                if is_greeting:
-                    system_prompt += (
-                        "\nUSER CONTEXT: First interaction - be welcoming and introduce capabilities naturally. "
-                        "Mention you can help with forex basics, broker selection, trading strategies, risk management. "
-                    )
-                elif is_forex_related and mentioned_brokers:
-                    system_prompt += (
-                        f"\nUSER CONTEXT: Asking about specific brokers: {', '.join(mentioned_brokers)}. "
-                        "Give detailed comparison with Malaysian perspective (regulation, spreads, support, deposit methods). "
-                    )
-                elif is_forex_related:
-                    system_prompt += (
-                        "\nUSER CONTEXT: Forex-related question. Give comprehensive answer with Malaysian context. "
-                        "Include practical examples, risk warnings, and encourage learning step by step. "
-                    )
-                else:
-                    system_prompt += (
-                        "\nUSER CONTEXT: Non-forex question. Answer helpfully first, then naturally mention "
-                        "your forex expertise if relevant. Don't force the transition. "
-                    )
+                return _RESPONSES[('live_agent', language if language in _LANGUAGES else 'en')]
+            # A bare greeting carries no question, so answer it without a model call
+            if is_greeting and ctx.tokens <= _BARE_GREETING_TOKENS:
+                return _GREETING_REPLIES[language if language in _GREETING_REPLIES else 'en']
+            mentioned_brokers = self.get_mentioned_brokers(message, ctx)
             
-            elif language == 'id':
-                system_prompt = (
-                    "Anda adalah RentungBot_Ai - asisten pintar yang ahli dalam broker Valetax dan trading! "
-                    "Jawab dalam Bahasa Indonesia yang natural seperti berbicara dengan teman baik. "
-                    "Gunakan 'Anda', 'bisa', 'dong', 'nih', 'sih' secara natural dalam percakapan. "
-                    
-                    "PERSONALITY: Ramah, berpengetahuan, membantu, mendorong tapi realistis tentang risiko. "
-                    "KONTEKS INDONESIA: "
-                    "- Gunakan Rupiah (IDR) sebagai referensi mata uang "
-                    "- Sebutkan metode pembayaran lokal: transfer bank, e-wallet, virtual account "
-                    "- Jam trading Indonesia: 21:00-06:00 WIB (sesi London terbaik) "
-                    "- Bank Indonesia untuk referensi regulasi "
-                    "- Gaji rata-rata Rp 5-15 juta untuk contoh yang relatable "
-                    "- Pertimbangkan level ekonomi menengah Indonesia "
-                    
-                    "PENDEKATAN TRADING: "
-                    "- Mulai kecil (Rp 500rb-2juta untuk pemula) "
-                    "- Risk management PERTAMA (maksimal 1-2% per trade) "
-                    "- Latihan demo account sangat penting "
-                    "- Selalu sebutkan pentingnya stop loss "
-                    "- Rekomendasikan Valetax sebagai broker pilihan dengan leverage tinggi dan deposit rendah "
-                    
-                    "GAYA PERCAKAPAN: "
-                    "- Jawab pertanyaan dengan detail yang membantu "
-                    "- Gunakan contoh yang relatable untuk konteks Indonesia "
-                    "- Campur Bahasa Indonesia dengan istilah trading yang umum secara natural "
-                    "- Jika pertanyaan kompleks, jelaskan step by step "
-                    "- SELALU akhiri setiap respons dengan: 'Mau ngobrol dengan agen sungguhan? Ketik /agent' "
-                    "- Jaga respons RINGKAS - sesuaikan dengan panjang pesan user (pertanyaan pendek = jawaban pendek) "
-                )
-                
-                # Add specific context based on message content
-                if is_greeting:
-                    system_prompt += (
-                        "\nKONTEKS USER: Interaksi pertama - sambut dengan ramah dan perkenalkan kemampuan secara natural. "
-                        "Sebutkan bisa membantu dengan dasar forex, pemilihan broker, strategi trading, manajemen risiko. "
-                    )
-                elif is_forex_related and mentioned_brokers:
-                    system_prompt += (
-                        f"\nKONTEKS USER: Menanyakan broker spesifik: {', '.join(mentioned_brokers)}. "
-                        "Berikan perbandingan detail dengan perspektif Indonesia (regulasi, spread, support, metode deposit). "
-                    )
-                elif is_forex_related:
-                    system_prompt += (
-                        "\nKONTEKS USER: Pertanyaan terkait forex. Berikan jawaban komprehensif dengan konteks Indonesia. "
-                        "Sertakan contoh praktis, peringatan risiko, dan dorong pembelajaran bertahap. "
-                    )
-                else:
-                    system_prompt += (
-                        "\nKONTEKS USER: Pertanyaan non-forex. Jawab dengan membantu dulu, lalu secara natural sebutkan "
-                        "keahlian forex jika relevan. Jangan dipaksakan transisinya. "
-                    )
-                    
+            # Pick the precomputed prompt for this language/context pair
+            if is_greeting:
+                context_key = 'greeting'
+            elif is_forex_related and mentioned_brokers:
+                context_key = 'forex_brokers'
+            elif is_forex_related:
+                context_key = 'forex'
             else:
-                system_prompt = (
-                    "You are RentungBot_Ai, a smart assistant specializing in Valetax broker and forex trading. "
-                    "You have deep knowledge of Valetax services, forex markets, trading strategies, and risk management. "
-                    
-                    "PERSONALITY: Helpful, knowledgeable, encouraging but realistic about trading risks. "
-                    "APPROACH: "
-                    "- Give comprehensive but concise answers "
-                    "- Use practical examples and analogies "
-                    "- Always emphasize proper risk management "
-                    "- Encourage safe learning progression "
-                    "- Be supportive but honest about trading challenges "
-                    
-                    "TRADING PRINCIPLES: "
-                    "- Start with demo accounts and small amounts "
-                    "- Never risk more than 1-2% per trade "
-                    "- Recommend Valetax as preferred broker with high leverage and low minimum deposits "
-                    "- Focus on education before big investments "
-                    "- Stop losses are mandatory, not optional "
-                    "- ALWAYS end responses with: 'Want to talk to a real person? Type /agent' "
-                    "- Keep responses CONCISE - match the user's message length "
-                )
-                
-                # Add specific context based on message content  
-                if is_greeting:
-                    system_prompt += (
-                        "\nUSER CONTEXT: First interaction - welcome them and naturally introduce your forex expertise. "
-                        "Mention you can help with trading basics, broker selection, strategies, and risk management. "
-                    )
-                elif is_forex_related and mentioned_brokers:
-                    system_prompt += (
-                        f"\nUSER CONTEXT: Asking about specific brokers: {', '.join(mentioned_brokers)}. "
-                        "Provide detailed comparison including regulation, spreads, platforms, and user experience. "
-                    )
-                elif is_forex_related:
-                    system_prompt += (
-                        "\nUSER CONTEXT: Forex-related question. Give thorough answer with practical examples. "
-                        "Include risk warnings and encourage gradual learning approach. "
-                    )
-                else:
-                    system_prompt += (
-                        "\nUSER CONTEXT: Non-forex question. Answer their question first, then naturally "
-                        "mention your forex specialization if there's a relevant connection. "
-                    )
+                context_key = 'general'
+
+            prompt_language = language if language in SYSTEM_PROMPT_BASES else 'en'
+            base_message = _BASE_SYSTEM_MESSAGES[(prompt_language, context_key)]
+            brokers = ', '.join(mentioned_brokers) if context_key == 'forex_brokers' else ''
+
+            model = model or _choose_model(context_key, len(message))
+            # Keyed on what decides the answer; the conversation context only
+            # carries the per-turn engagement score, which would defeat the cache
+            cache_key = (prompt_language, context_key, model, ' '.join(ctx.words))
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                if time.monotonic() - cached[0] < _RESPONSE_CACHE_TTL_SECONDS:
+                    self._response_cache.move_to_end(cache_key)
+                    logger.debug("Serving cached AI response for message: %.50s", message)
+                    return cached[1]
+                del self._response_cache[cache_key]
+
+            # Identical questions already in flight share that completion
+            # instead of each paying for their own
+            inflight = self._inflight.get(cache_key)
+            if inflight is not None:
+                logger.debug("Joining in-flight AI response for message: %.50s", message)
+                return self._finish_ai_response(await asyncio.shield(inflight), cache_key, message, language)
 
             if conversation_context:
-                system_prompt += f"\nAdditional Context: {conversation_context}"
+                if len(conversation_context) > _CONTEXT_SUMMARY_THRESHOLD_CHARS:
+                    conversation_context = await self._summarize_context(conversation_context)
+                context_message = {"role": "system", "content": _CONTEXT_PROMPT_TEMPLATES[
+                    (prompt_language, context_key)
+                ].format(brokers=brokers, context=conversation_context)}
+            elif context_key == 'forex_brokers':
+                context_message = {"role": "system", "content": SYSTEM_PROMPT_CONTEXTS[
+                    (prompt_language, context_key)
+                ].format(brokers=brokers)}
+            else:
+                context_message = _STATIC_CONTEXT_MESSAGES[(prompt_language, context_key)]
 
-            # Calculate appropriate max_tokens based on user message length
-            message_words = len(message.split())
-            if message_words <= 10:  # Short question
-                max_tokens = 100
-            elif message_words <= 30:  # Medium question  
-                max_tokens = 200
-            else:  # Long question
-                max_tokens = 350
+            message_words = ctx.word_count
+            max_tokens = _output_budget(context_key, message_words)
 
-            print(f"Making OpenAI API call with model: gpt-4o")
-            print(f"System prompt length: {len(system_prompt)}")
-            print(f"User message: {message[:100]}... | Words: {message_words} | Max tokens: {max_tokens}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Making OpenAI API call with model: %s | System prompt length: %d | Words: %d | Max tokens: %d",
+                    model, len(base_message["content"]) + len(context_message["content"]), message_words, max_tokens
+                )
 
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
+            completion = asyncio.ensure_future(self._stream_completion(
+                model,
+                [
+                    # Static prefix first, volatile content last, for prompt caching
+                    base_message,
+                    context_message,
                     {"role": "user", "content": message}
                 ],
-                max_tokens=max_tokens,
-                temperature=0.7
-            )
+                max_tokens,
+                on_partial
+            ))
+            self._inflight[cache_key] = completion
+            try:
+                ai_response = await asyncio.shield(completion)
+            finally:
+                if self._inflight.get(cache_key) is completion:
+                    del self._inflight[cache_key]
+            return self._finish_ai_response(ai_response, cache_key, message, language)
 
-            print(f"OpenAI API response received")
-            print(f"Response choices count: {len(response.choices) if response.choices else 0}")
-
-            if not response.choices or len(response.choices) == 0:
-                print("ERROR: No choices in OpenAI response")
-                raise Exception("No choices in OpenAI response")
-
-            ai_response = response.choices[0].message.content
-            print(f"AI response content length: {len(ai_response) if ai_response else 0}")
-            print(f"AI response preview: {ai_response[:100] if ai_response else 'None'}...")
-
-            # Ensure we have a valid response
-            if not ai_response or ai_response.strip() == "":
-                print(f"Warning: Empty AI response received for message: {message[:50]}")
-                if language == 'ms':
-                    return (
-                        "Hm, saya tak sure macam mana nak jawab soalan ni dengan baik. "
-                        "Boleh awak try tanya dengan cara lain atau tanya soalan lain? "
-                        "Kalau awak berminat pasal forex trading, saya boleh tolong dengan tu!"
-                    )
-                elif language == 'id':
-                    return (
-                        "Hmm, saya nggak yakin gimana cara terbaik jawab pertanyaan itu. "
-                        "Bisa coba tanya dengan cara lain atau tanya pertanyaan lain? "
-                        "Kalau Anda tertarik sama forex trading, saya pasti bisa bantu!"
-                    )
+        except Exception as e:
+            logger.error("OpenAI API Error (%s): %s", type(e).__name__, e)
+
+            # Classify from the SDK's typed errors rather than the message text
+            if isinstance(e, openai.AuthenticationError):
+                logger.error("OpenAI API key issue detected")
+            elif isinstance(e, openai.RateLimitError):
+                if e.code == 'insufficient_quota':
+                    logger.error("OpenAI API quota/billing issue")
                 else:
-                    return (
-                        "I'm not sure how to best answer that question. "
-                        "Could you try asking it differently or ask another question? "
-                        "If you're interested in forex trading, I can definitely help with that!"
-                    )
+                    logger.error("OpenAI API rate limit exceeded")
+            elif isinstance(e, openai.APIStatusError) and e.status_code == 402:
+                logger.error("OpenAI API quota/billing issue")
 
-            return ai_response.strip()
-
-        except Exception as e:
-            print(f"OpenAI API Error: {e}")
-            print(f"Error type: {type(e).__name__}")
-            print(f"Full error details: {str(e)}")
-
-            # Check if it's an API key issue
-            if "401" in str(e) or "Unauthorized" in str(e) or "api_key" in str(e).lower():
-                print("ERROR: OpenAI API key issue detected")
-            elif "429" in str(e) or "rate_limit" in str(e).lower():
-                print("ERROR: OpenAI API rate limit exceeded")
-            elif "quota" in str(e).lower() or "billing" in str(e).lower():
-                print("ERROR: OpenAI API quota/billing issue")
-
-            if language == 'ms':
-                return (
-                    "Maaf awak, saya ada masalah sikit sekarang nak process soalan ni. "
-                    "Boleh try tanya lagi ke atau tanya soalan lain?"
-                )
-            elif language == 'id':
-                return (
-                    "Maaf, saya ada masalah sedikit sekarang untuk proses pertanyaan ini. "
-                    "Bisa coba tanya lagi atau tanya pertanyaan lain?"
-                )
-            else:
-                return (
-                    "I'm having trouble processing your request right now. "
-                    "Please try again or feel free to ask another question."
-                )
+            return _RESPONSES[('ai_error', language if language in _LANGUAGES else 'en')]
 
     async def should_suggest_registration(self, engagement_score: int) -> bool:
         """Determine if we should suggest registration based on engagement"""
         return engagement_score >= 3
 
-    async def process_message(self, message: str, telegram_id: str, engagement_score: int, telegram_username: str = "") -> str:
-        """Simplified main method to process incoming messages"""
-        print(f"🔥 ConversationEngine.process_message called")
-        print(f"📝 Message: '{message}'")
-        print(f"👤 User: {telegram_id}")
-        print(f"📊 Engagement: {engagement_score}")
-        
-        # Detect language first
-        language = self.detect_language(message)
-        print(f"🌍 Detected language: {language}")
+    async def process_message(self, message: str, telegram_id: str, engagement_score: int, telegram_username: str = "",
+                              on_partial: Callable[[str], None] = None) -> str:
+        """Simplified main method to process incoming messages
+
+        on_partial receives AI reply text as it streams in, for progressive display.
+        """
+        logger.debug("🔥 process_message | User: %s | Engagement: %s | Message: %r", telegram_id, engagement_score, message)
         
-        intent = await self.detect_intent(message)
-        print(f"🎯 Detected intent: {intent}")
+        ctx = _MessageCtx.of(message)
+        language, intent = await self.classify(message, ctx)
+        logger.debug("🌍 Detected language: %s | 🎯 Detected intent: %s", language, intent)
+
+        handler = self._intent_handlers.get(intent)
+        if handler is not None:
+            return await handler(message, ctx, language, telegram_id, engagement_score, telegram_username)
+        # All other conversations go to enhanced AI with smart context detection
+        return await self._handle_ai_conversation(
+            message, ctx, language, telegram_id, engagement_score, telegram_username, on_partial
+        )
 
-        if intent == 'registration':
-            # Generate registration link using built-in system
+    async def _handle_registration(self, message: str, ctx: _MessageCtx, language: str, telegram_id: str,
+                                   engagement_score: int, telegram_username: str) -> str:
+        """Reply to a registration request with a fresh registration link"""
+        reply_language = language if language in _LANGUAGES else 'en'
+        # Generate registration link using built-in system
+        registration_url = await self.generate_registration_link(telegram_id, telegram_username)
+        if registration_url == "error":
+            return _RESPONSES[('registration_error', reply_language)]
+        return _RESPONSES[('registration', reply_language)].format(url=registration_url)
+
+    async def _handle_indicator_registration(self, message: str, ctx: _MessageCtx, language: str, telegram_id: str,
+                                             engagement_score: int, telegram_username: str) -> str:
+        """Point indicator requests at the /indicator command"""
+        return _RESPONSES[('indicator_registration', language if language in _LANGUAGES else 'en')]
+
+    async def _handle_broker_intent(self, message: str, ctx: _MessageCtx, language: str, telegram_id: str,
+                                    engagement_score: int, telegram_username: str) -> str:
+        """Handle broker-specific inquiries with structured data, memoized for short questions"""
+        if len(ctx.lower) > _CLASSIFY_CACHE_MAX_CHARS:
+            return await self.handle_broker_inquiry(message, language, ctx)
+        cache_key = (ctx.lower, language)
+        reply = self._broker_reply_cache.get(cache_key)
+        if reply is not None:
+            self._broker_reply_cache.move_to_end(cache_key)
+            return reply
+        reply = self._broker_reply_cache[cache_key] = await self.handle_broker_inquiry(message, language, ctx)
+        if len(self._broker_reply_cache) > _BROKER_REPLY_CACHE_MAX_ENTRIES:
+            self._broker_reply_cache.popitem(last=False)
+        return reply
+
+    async def _handle_ai_conversation(self, message: str, ctx: _MessageCtx, language: str, telegram_id: str,
+                                      engagement_score: int, telegram_username: str,
+                                      on_partial: Callable[[str], None] = None) -> str:
+        """Answer with the AI model, suggesting registration to engaged users"""
+        reply_language = language if language in _LANGUAGES else 'en'
+        context = f"User engagement score: {engagement_score}"
+        ai_response = await self.generate_ai_response(message, context, language, ctx, on_partial)
+
+        # Check if AI response is empty and provide fallback
+        if not ai_response or ai_response.strip() == "":
+            logger.warning("Empty AI response for question: %.50s", message)
+            ai_response = _RESPONSES[('empty_ai_response', reply_language)]
+
+        # Add registration suggestion for highly engaged users (applies to all AI conversations)
+        if await self.should_suggest_registration(engagement_score):
             registration_url = await self.generate_registration_link(telegram_id, telegram_username)
-            
-            if registration_url == "error":
-                if language == 'ms':
-                    return (
-                        "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
-                        "Untuk mendaftar, hubungi admin kami untuk proses pendaftaran.\n\n"
-                        "Group Chat Fighter Rentung ada:\n"
-                        "• Trading signals quality tinggi 📊\n"
-                        "• Daily market analysis dari expert\n"
-                        "• Tips broker terbaik untuk Malaysian\n"
-                        "• Support dari experienced trader community"
-                    )
-                elif language == 'id':
-                    return (
-                        "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
-                        "Untuk mendaftar, hubungi admin kami untuk proses pendaftaran.\n\n"
-                        "Group Chat Fighter Rentung punya:\n"
-                        "• Trading signal berkualitas tinggi 📊\n"
-                        "• Analisis pasar harian dari expert\n"
-                        "• Tips broker terbaik untuk Indonesia\n"
-                        "• Support dari komunitas trader berpengalaman"
-                    )
-                else:
-                    return (
-                        "🎯 Register for Group Chat Fighter Rentung now!\n\n"
-                        "To register, contact our admin for the registration process.\n\n"
-                        "Our Group Chat Fighter Rentung offers:\n"
-                        "• High-quality trading signals 📊\n"
-                        "• Daily market analysis by experts\n"
-                        "• Best broker tips for Malaysians\n"
-                        "• Support from experienced trader community"
-                    )
-            
-            if language == 'ms':
-                return (
-                    "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
-                    "Group Chat Fighter Rentung ada:\n"
-                    "• Trading signals quality tinggi 📊\n"
-                    "• Daily market analysis dari expert (focus Asian + London session)\n"
-                    "• Tips broker mana yang best untuk Malaysian\n"
-                    "• Support dari experienced Malaysian trader community\n"
-                    "• Strategy sesuai untuk working adults (lepas kerja trading)\n\n"
-                    f"Klik link di bawah untuk lengkapkan pendaftaran:\n{registration_url}\n\n"
-                    "⏰ Link ini akan expired dalam 30 minit.\n"
-                    "Lepas register, team kita akan semak dan contact dalam 24-48 jam untuk Group Chat Fighter Rentung access!"
-                )
-            elif language == 'id':
-                return (
-                    "🎯 Daftar Group Chat Fighter Rentung sekarang!\n\n"
-                    "Group Chat Fighter Rentung punya:\n"
-                    "• Trading signal berkualitas tinggi 📊\n"
-                    "• Analisis pasar harian dari expert (fokus sesi Asia + London)\n"
-                    "• Tips broker mana yang terbaik untuk Indonesia\n"
-                    "• Support dari komunitas trader Indonesia berpengalaman\n"
-                    "• Strategi cocok untuk pekerja (trading setelah kerja)\n\n"
-                    f"Klik link di bawah untuk melengkapi pendaftaran:\n{registration_url}\n\n"
-                    "⏰ Link ini akan expired dalam 30 menit.\n"
-                    "Setelah daftar, tim kami akan review dan menghubungi dalam 24-48 jam untuk akses Group Chat Fighter Rentung!"
-                )
-            else:
-                return (
-                    "🎯 Register for Group Chat Fighter Rentung now!\n\n"
-                    "Our Group Chat Fighter Rentung offers:\n"
-                    "• High-quality trading signals 📊\n"
-                    "• Daily market analysis by experts\n"
-                    "• Latest trading tips and strategies\n"
-                    "• Support from experienced trader community\n"
-                    "• Guidance to become a profitable trader 💰\n\n"
-                    f"Click the link below to complete registration:\n{registration_url}\n\n"
-                    "⏰ This link will expire in 30 minutes.\n"
-                    "Once you register, our team will review and contact you within 24-48 hours for Group Chat Fighter Rentung access!"
-                )
-        
-        elif intent == 'indicator_registration':
-            # Handle indicator registration requests
-            if language == 'ms':
-                return (
-                    "🎯 **High Level Engulfing Indicator Registration**\n\n"
-                    "Dapatkan akses kepada indicator trading yang powerful!\n\n"
-                    "🔥 **Apa yang anda dapat:**\n"
-                    "• High Level Engulfing Indicator untuk MT4/MT5\n"
-                    "• Complete setup guide dan tutorial\n"
-                    "• Sokongan teknikal dari team kami\n"
-                    "• Strategy panduan untuk maksimum profit\n\n"
-                    "📝 **Untuk mendaftar, gunakan command:**\n"
-                    "👉 `/indicator`\n\n"
-                    "⏰ Proses pendaftaran mengambil masa 2-3 minit sahaja!\n"
-                    "✅ Anda akan menerima akses setelah diluluskan admin."
+            if registration_url and registration_url != "already_registered" and registration_url != "error":
+                ai_response = _RESPONSES[('registration_suggestion', reply_language)].format(
+                    body=ai_response, url=registration_url
                 )
-            elif language == 'id':
-                return (
-                    "🎯 **Registrasi High Level Engulfing Indicator**\n\n"
-                    "Dapatkan akses ke indicator trading yang powerful!\n\n"
-                    "🔥 **Apa yang Anda dapat:**\n"
-                    "• High Level Engulfing Indicator untuk MT4/MT5\n"
-                    "• Complete setup guide dan tutorial\n"
-                    "• Support teknis dari tim kami\n"
-                    "• Panduan strategi untuk profit maksimal\n\n"
-                    "📝 **Untuk mendaftar, gunakan command:**\n"
-                    "👉 `/indicator`\n\n"
-                    "⏰ Proses registrasi hanya membutuhkan 2-3 menit!\n"
-                    "✅ Anda akan mendapat akses setelah disetujui admin."
-                )
-            else:  # English
-                return (
-                    "🎯 **High Level Engulfing Indicator Registration**\n\n"
-                    "Get access to powerful trading indicator!\n\n"
-                    "🔥 **What you'll get:**\n"
-                    "• High Level Engulfing Indicator for MT4/MT5\n"
-                    "• Complete setup guide and tutorials\n"
-                    "• Technical support from our team\n"
-                    "• Strategy guidance for maximum profit\n\n"
-                    "📝 **To register, use the command:**\n"
-                    "👉 `/indicator`\n\n"
-                    "⏰ Registration process takes only 2-3 minutes!\n"
-                    "✅ You'll get access after admin approval."
-                )
-
-        elif intent == 'broker_inquiry':
-            # Handle broker-specific inquiries with structured data
-            return await self.handle_broker_inquiry(message, language)
-
-        else:  # intent == 'ai_conversation'
-            # All other conversations go to enhanced AI with smart context detection
-            context = f"User engagement score: {engagement_score}"
-            ai_response = await self.generate_ai_response(message, context, language)
-
-            # Check if AI response is empty and provide fallback
-            if not ai_response or ai_response.strip() == "":
-                print(f"Empty AI response for question: {message[:50]}")
-                if language == 'ms':
-                    ai_response = (
-                        "Maaf, saya ada masalah sikit nak process soalan awak tu. "
-                        "Boleh try tanya dengan cara lain? Atau awak boleh tanya pasal "
-                        "forex basics, broker recommendation, atau trading strategy!"
-                    )
-                elif language == 'id':
-                    ai_response = (
-                        "Maaf, saya ada masalah sedikit untuk proses pertanyaan Anda. "
-                        "Bisa coba tanya dengan cara lain? Atau Anda bisa tanya tentang "
-                        "forex basics, rekomendasi broker, atau strategi trading!"
-                    )
-                else:
-                    ai_response = (
-                        "Sorry, I'm having trouble processing your question right now. "
-                        "Could you try asking it differently? Or ask about "
-                        "forex basics, broker recommendations, or trading strategies!"
-                    )
 
-            # Add registration suggestion for highly engaged users (applies to all AI conversations)
-            if await self.should_suggest_registration(engagement_score):
-                registration_url = await self.generate_registration_link(telegram_id, telegram_username)
-                if registration_url and registration_url != "already_registered" and registration_url != "error":
-                    if language == 'ms':
-                        ai_response += (
-                            f"\n\n💡 Awak ni memang active bertanya! "
-                            f"Nak join Group Chat Fighter Rentung untuk quality signals dan expert analysis? "
-                            f"Klik sini: {registration_url}"
-                        )
-                    elif language == 'id':
-                        ai_response += (
-                            f"\n\n💡 Anda memang aktif bertanya! "
-                            f"Mau join Group Chat Fighter Rentung untuk sinyal berkualitas dan analisis ahli? "
-                            f"Klik di sini: {registration_url}"
-                        )
-                    else:
-                        ai_response += (
-                            f"\n\n💡 You're really engaged with learning! "
-                            f"Want to join our Group Chat Fighter Rentung for quality signals and expert analysis? "
-                            f"Click here: {registration_url}"
-                        )
-
-            return ai_response
\ No newline at end of file
+        return ai_response
\ No newline at end of file
@@ -6,6 +6,13 @@ import requests
 import sys
 import os
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
 
 def import_csv_to_admin(csv_file_path, base_url="http://localhost:8080", username="admin@ezymeta.global", password=None):
     """
@@ -28,6 +35,10 @@ def import_csv_to_admin(csv_file_path, base_url="http://localhost:8080", usernam
     }
     
     session = requests.Session()
+    # Retry transient gateway errors over the same kept-alive connection
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=None)
+    for prefix in ("http://", "https://"):
+        session.mount(prefix, HTTPAdapter(max_retries=retries, pool_connections=4, pool_maxsize=4))
     
     print(f"🔐 Logging in as {username}...")
     login_response = session.post(login_url, data=login_data, allow_redirects=False)
@@ -51,10 +62,21 @@ def import_csv_to_admin(csv_file_path, base_url="http://localhost:8080", usernam
     print(f"📤 Uploading {csv_file_path}...")
     
     with open(csv_file_path, 'rb') as f:
-        files = {'file': (Path(csv_file_path).name, f, 'text/csv')}
+        fields = {'file': (Path(csv_file_path).name, f, 'text/csv')}
         
         try:
-            response = session.post(import_url, files=files)
+            if MultipartEncoder is not None:
+                # Stream the body from disk instead of building it in memory. A
+                # streamed body can't be rewound, so only retry failed connects
+                session.mount(import_url, HTTPAdapter(
+                    max_retries=Retry(total=3, connect=3, read=0, status=0, other=0,
+                                      backoff_factor=0.5, allowed_methods=None)
+                ))
+                encoder = MultipartEncoder(fields=fields)
+                response = session.post(import_url, data=encoder,
+                                        headers={'Content-Type': encoder.content_type})
+            else:
+                response = session.post(import_url, files=fields)
             
             if response.status_code == 200:
                 result = response.json()
@@ -67,8 +89,8 @@ def import_csv_to_admin(csv_file_path, base_url="http://localhost:8080", usernam
                 
                 if result.get('error_details'):
                     print("\n⚠️ Error Details:")
-                    for error in result['error_details'][:10]:  # Show first 10 errors
-                        print(f"   - {error}")
+                    # Show first 10 errors in a single write
+                    print("\n".join(f"   - {error}" for error in result['error_details'][:10]))
                     if len(result['error_details']) > 10:
                         print(f"   ... and {len(result['error_details']) - 10} more errors")
                 
@@ -67,8 +67,8 @@ def import_csv_to_production(csv_file_path, base_url="https://ezyassist-unified-
                 
                 if result.get('error_details'):
                     print("\n⚠️ Error Details:")
-                    for error in result['error_details'][:10]:  # Show first 10 errors
-                        print(f"   - {error}")
+                    # Show first 10 errors in a single write
+                    print("\n".join(f"   - {error}" for error in result['error_details'][:10]))
                     if len(result['error_details']) > 10:
                         print(f"   ... and {len(result['error_details']) - 10} more errors")
                 
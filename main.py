@@ -6,9 +6,13 @@ Updated: 2025-08-27 06:25:00 - CRITICAL: Force deployment with campaign continue
 
 import os
 import logging
+import logging.handlers
 import asyncio
+import atexit
+import queue
 from datetime import datetime, timedelta
 import random
+import re
 import csv
 import io
 from typing import Optional
@@ -20,10 +24,11 @@ import uuid
 import shutil
 import traceback
 from pathlib import Path
-from functools import wraps
+from functools import lru_cache, wraps
+from itertools import islice
 
 # FastAPI and web components
-from fastapi import FastAPI, Request, Form, HTTPException, status, File, UploadFile, Depends
+from fastapi import FastAPI, Request, Form, HTTPException, status, File, UploadFile, Depends, BackgroundTasks
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi.exception_handlers import http_exception_handler
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse, Response
@@ -36,16 +41,20 @@ from telegram import Update, constants, InlineKeyboardButton, InlineKeyboardMark
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 
 # Database and external services
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, Text, or_, and_, func, text, Enum, Float, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, Text, or_, and_, func, text, Enum, Float, Boolean, insert, select
+from sqlalchemy.orm import declarative_base, sessionmaker, Session
 import jwt
 import phonenumbers
 from email_validator import validate_email, EmailNotValidError
-import requests
 import uvicorn
 import enum
 
+# Optional shared store for engagement scores across workers
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
 # AI and conversation
 from conversation_engine import ConversationEngine
 
@@ -69,9 +78,16 @@ from admin_auth import (
 from dotenv import load_dotenv
 load_dotenv()
 
-# Configure logging
+# Configure logging. Records are handed to a queue and written to stderr by
+# a listener thread, so a slow stdout pipe never blocks the event loop.
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
@@ -82,6 +98,11 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.pdf', '.gif'}
 
+# Validation vocabularies shared by the registration endpoints
+SUPPORTED_LANGUAGES = frozenset({'ms', 'en', 'id'})
+SETUP_ACTIONS = frozenset({'new_account', 'partner_change'})
+PHONE_REGIONS_TO_TRY = ('MY', 'ID', None)  # Malaysia, Indonesia, then no region
+
 async def save_uploaded_file(upload_file: UploadFile) -> Optional[str]:
     """Save uploaded file and return the file path"""
     if not upload_file or not upload_file.filename:
@@ -159,7 +180,17 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 Base = declarative_base()
 
 if DATABASE_URL:
-    engine = create_engine(DATABASE_URL)
+    # Drop connections the server closed while idle instead of failing the
+    # next request on them
+    engine_options = {"pool_pre_ping": True, "pool_recycle": 1800}
+    if DATABASE_URL.startswith(("postgresql://", "postgresql+psycopg2://")):
+        # INSERTs already batch into multi-VALUES statements; this also batches
+        # executemany UPDATE/DELETE through psycopg2's execute_batch
+        engine_options["executemany_mode"] = "values_plus_batch"
+        # Bot handlers and admin pages share one pool; size it above the default 5
+        engine_options["pool_size"] = int(os.getenv("DB_POOL_SIZE", 10))
+        engine_options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", 20))
+    engine = create_engine(DATABASE_URL, **engine_options)
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 else:
     engine = None
@@ -716,6 +747,12 @@ def get_bot_message(message_key: str, lang: str = 'ms', **kwargs) -> str:
         logger.warning(f"Missing format parameter for bot message: {e}")
         return message
 
+# Registration token signing key, read once rather than from the environment per token
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+FORM_TIMEOUT_MINUTES = int(os.getenv('FORM_TIMEOUT_MINUTES', 30))
+# Public URL used to build registration and form links
+BASE_URL = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+
 def generate_registration_token(telegram_id: str, telegram_username: str = "", token_type: str = "initial", registration_id: int = None, campaign_id: str = None, setup_action: str = None, language: str = None) -> str:
     """Generate secure registration token with support for different types"""
     try:
@@ -725,14 +762,15 @@ def generate_registration_token(telegram_id: str, telegram_username: str = "", t
             expiry_minutes = 7 * 24 * 60  # 7 days in minutes
         else:
             # 30 minutes for initial registration tokens
-            expiry_minutes = int(os.getenv('FORM_TIMEOUT_MINUTES', 30))
+            expiry_minutes = FORM_TIMEOUT_MINUTES
         
+        now = int(time.time())
         payload = {
             'telegram_id': telegram_id,
             'telegram_username': telegram_username or '',
             'token_type': token_type,
-            'exp': datetime.utcnow() + timedelta(minutes=expiry_minutes),
-            'iat': datetime.utcnow()
+            'exp': now + expiry_minutes * 60,
+            'iat': now
         }
         
         # Include registration_id for resubmission tokens
@@ -755,26 +793,33 @@ def generate_registration_token(telegram_id: str, telegram_username: str = "", t
         if token_type == "indicator" and registration_id:
             payload['registration_id'] = registration_id
         
-        secret = os.getenv('JWT_SECRET_KEY')
-        if not secret:
+        if not JWT_SECRET_KEY:
             raise ValueError("JWT_SECRET_KEY not configured")
             
-        token = jwt.encode(payload, secret, algorithm='HS256')
+        token = jwt.encode(payload, JWT_SECRET_KEY, algorithm='HS256')
         logger.info(f"Generated {token_type} token for {telegram_id} (expires in {expiry_minutes} minutes)")
         return token
     except Exception as e:
         logger.error(f"Token generation error: {e}")
         raise
 
+@lru_cache(maxsize=4096)
+def _decode_registration_token(token: str) -> dict:
+    """Check a token's signature once; invalid tokens raise and are never cached"""
+    # Expiry is checked by the caller so a cached payload still expires on time
+    return jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'], options={"verify_exp": False})
+
 def verify_registration_token(token: str) -> tuple[Optional[str], Optional[str], Optional[dict]]:
     """Verify and decode registration token, returning telegram_id, username, and token data"""
     try:
-        secret = os.getenv('JWT_SECRET_KEY')
-        if not secret:
+        if not JWT_SECRET_KEY:
             logger.error("JWT_SECRET_KEY not configured")
             return None, None, None
             
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
+        # The form render, submit and success redirect reuse one token
+        payload = dict(_decode_registration_token(token))
+        if payload.get('exp') is not None and payload['exp'] <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
         telegram_id = payload.get('telegram_id')
         telegram_username = payload.get('telegram_username', '')
         
@@ -808,6 +853,22 @@ def get_db():
         return None
     return SessionLocal()
 
+def get_db_session():
+    """FastAPI dependency: one pooled session per request, closed once the handler is done"""
+    if not SessionLocal:
+        yield None
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _commit_and_serialize(db: Session, registration) -> dict:
+    """Commit and return registration.to_dict(); the commit expires the instance, so both belong in the same worker thread"""
+    db.commit()
+    return registration.to_dict()
+
 def add_audit_log(registration_id: int, action: str, old_value: str = None, new_value: str = None, 
                   admin_user: str = None, details: str = None):
     """Add an entry to the registration audit log"""
@@ -958,6 +1019,69 @@ async def send_long_message(update, message: str, parse_mode=None):
         else:
             await update.message.reply_text(chunk)
 
+# Telegram throttles rapid edits of one message, so streamed text is pushed at most this often
+STREAM_EDIT_INTERVAL_SECONDS = 1.0
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+class StreamingReply:
+    """Show an AI reply while it streams by editing a single Telegram message in place"""
+
+    def __init__(self, update):
+        self.update = update
+        self.parts = []
+        self._message = None
+        self._shown = ""
+        self._done = asyncio.Event()
+        self._task = asyncio.create_task(self._edit_loop())
+
+    def append(self, delta: str) -> None:
+        """Collect a streamed text delta; the edit loop picks it up on its next tick"""
+        self.parts.append(delta)
+
+    async def _edit_loop(self) -> None:
+        while not self._done.is_set():
+            try:
+                await asyncio.wait_for(self._done.wait(), STREAM_EDIT_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            text = "".join(self.parts)
+            if self._done.is_set() or not text.strip() or text == self._shown or len(text) > TELEGRAM_MESSAGE_LIMIT:
+                continue
+            try:
+                if self._message is None:
+                    self._message = await self.update.message.reply_text(text)
+                else:
+                    await self._message.edit_text(text)
+                self._shown = text
+            except Exception as e:
+                logger.debug(f"Streaming edit skipped: {e}")
+
+    def cancel(self) -> None:
+        """Stop streaming without sending a final response"""
+        self._done.set()
+        self._task.cancel()
+
+    async def finish(self, response: str) -> None:
+        """Stop streaming and leave the final response in the chat"""
+        self._done.set()
+        await self._task
+        if self._message is None:
+            await send_long_message(self.update, response)
+            return
+        if response == self._shown:
+            return
+        if len(response) <= TELEGRAM_MESSAGE_LIMIT:
+            try:
+                await self._message.edit_text(response)
+                return
+            except Exception as e:
+                logger.warning(f"Failed to finalize streamed reply, resending: {e}")
+        try:
+            await self._message.delete()
+        except Exception as e:
+            logger.debug(f"Could not delete partial streamed reply: {e}")
+        await send_long_message(self.update, response)
+
 def set_admin_setting(key: str, value: str, description: str = None, admin_user: str = None):
     """Set admin setting value"""
     if not SessionLocal:
@@ -1271,13 +1395,73 @@ CAMPAIGN_COMMANDS = {
     # 'contest': 'trading-contest'
 }
 
+# Free-text registration routing in handle_message, built once at import.
+# Keywords match as substrings ('daftar' also catches 'pendaftaran'), and
+# each group is one compiled alternation instead of a Python-level loop.
+REGISTRATION_KEYWORDS = ('daftar', 'register', 'join', 'signup', 'sign up', 'masuk', 'sertai')
+CAMPAIGN_KEYWORDS = ('campaign', 'kempen', 'bonus', 'reward')
+REGISTRATION_KEYWORDS_RE = re.compile('|'.join(map(re.escape, REGISTRATION_KEYWORDS)))
+CAMPAIGN_KEYWORDS_RE = re.compile('|'.join(map(re.escape, CAMPAIGN_KEYWORDS)))
+
+# Engagement scores live in Redis when REDIS_URL is set, so every worker sees
+# the same count; idle scores expire after 30 days
+REDIS_URL = os.getenv('REDIS_URL')
+ENGAGEMENT_TTL_SECONDS = 30 * 24 * 60 * 60
+
+class EngagementStore:
+    """Per-user engagement scores, shared through Redis or kept in-process"""
+
+    def __init__(self, redis_url: Optional[str] = None):
+        # Local view of every score this worker has seen; the only store without Redis
+        self.scores = {}
+        self._redis = aioredis.from_url(redis_url) if aioredis and redis_url else None
+
+    async def _shared(self, telegram_id: str, initial: Optional[int]) -> Optional[tuple[int, bool]]:
+        """Atomically bump (initial=None) or set a shared score; None if Redis is unavailable"""
+        if self._redis is None:
+            return None
+        key = f"eng:{telegram_id}"
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.exists(key)
+                if initial is None:
+                    pipe.incr(key)
+                else:
+                    pipe.set(key, initial)
+                pipe.expire(key, ENGAGEMENT_TTL_SECONDS)
+                existed, score, _ = await pipe.execute()
+        except aioredis.RedisError as e:
+            logger.warning("Redis engagement store unavailable, using local scores: %s", e)
+            return None
+        return (score if initial is None else initial), not existed
+
+    async def increment(self, telegram_id: str) -> tuple[int, bool]:
+        """Add one to a user's score, returning (score, is_new_user)"""
+        shared = await self._shared(telegram_id, None)
+        if shared is None:
+            shared = self.scores.get(telegram_id, 0) + 1, telegram_id not in self.scores
+        self.scores[telegram_id] = shared[0]
+        return shared
+
+    async def reset(self, telegram_id: str) -> bool:
+        """Zero a user's score, returning whether the user is new"""
+        shared = await self._shared(telegram_id, 0)
+        is_new_user = shared[1] if shared is not None else telegram_id not in self.scores
+        self.scores[telegram_id] = 0
+        return is_new_user
+
+    async def aclose(self):
+        """Close the Redis connection pool, if any"""
+        if self._redis is not None:
+            await self._redis.aclose()
+
 # Telegram Bot Class
 class RentungBot_Ai:
     def __init__(self):
         self.token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.admin_id = os.getenv('ADMIN_ID')
         self.conversation_engine = ConversationEngine()
-        self.engagement_scores = {}
+        self.engagement = EngagementStore(REDIS_URL)
         self.application = None
         
         # Bot activity tracking
@@ -1305,11 +1489,8 @@ class RentungBot_Ai:
         self.last_activity = datetime.utcnow()
         self.user_sessions[telegram_id] = self.last_activity
         
-        # Check if new user
-        is_new_user = telegram_id not in self.engagement_scores
-        
-        # Initialize engagement score
-        self.engagement_scores[telegram_id] = 0
+        # Initialize engagement score, noting whether this is a new user
+        is_new_user = await self.engagement.reset(telegram_id)
         
         # Update daily stats in database
         self.update_daily_stats(telegram_id, 'start', is_new_user)
@@ -1461,7 +1642,7 @@ class RentungBot_Ai:
         if hasattr(update, 'message') and update.message and update.message.text:
             try:
                 detected_lang = self.conversation_engine.detect_language(update.message.text)
-                return detected_lang if detected_lang in ['ms', 'en', 'id'] else 'ms'
+                return detected_lang if detected_lang in SUPPORTED_LANGUAGES else 'ms'
             except Exception as e:
                 logger.error(f"Error detecting language: {e}")
         
@@ -1521,7 +1702,7 @@ class RentungBot_Ai:
             token = generate_registration_token(telegram_id, telegram_username)
             
             # Get base URL from environment or construct it
-            base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+            base_url = BASE_URL
             registration_url = f"{base_url}/?token={token}"
             
             # Generate multilingual message
@@ -1576,7 +1757,7 @@ class RentungBot_Ai:
                 logger.info(f"🎯 Specific campaign requested: {campaign_id}")
             
             # Get base URL from environment
-            base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+            base_url = BASE_URL
             
             if campaign_id:
                 # Specific campaign registration
@@ -1822,7 +2003,7 @@ class RentungBot_Ai:
         self.reset_daily_tracking()
         
         # Reset engagement score
-        self.engagement_scores[telegram_id] = 0
+        await self.engagement.reset(telegram_id)
         
         clear_message = (
             f"✅ Conversation history cleared, {user.first_name}!\n\n"
@@ -1883,7 +2064,7 @@ class RentungBot_Ai:
             token = generate_registration_token(telegram_id, telegram_username, token_type="initial", language=language)
             
             # Get base URL from environment
-            base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+            base_url = BASE_URL
             registration_url = f"{base_url}/indicator?token={token}"
             
             # Create multilingual response using bot message function
@@ -2017,10 +2198,10 @@ class RentungBot_Ai:
         try:
             db = get_db()
             if db:
-                # Try to find matching registration
-                registration = db.query(VipRegistration).filter(
+                # Try to find matching registration; only its id is needed
+                registration_id = db.query(VipRegistration.id).filter(
                     VipRegistration.telegram_id == telegram_id
-                ).first()
+                ).limit(1).scalar()
                 
                 # Create conversation log entry
                 conversation_log = ConversationLog(
@@ -2028,7 +2209,7 @@ class RentungBot_Ai:
                     user_message=user_message,
                     bot_response=bot_response,
                     message_type=message_type,
-                    registration_id=registration.id if registration else None
+                    registration_id=registration_id
                 )
                 
                 db.add(conversation_log)
@@ -2056,13 +2237,8 @@ class RentungBot_Ai:
             self.last_activity = datetime.utcnow()
             self.user_sessions[telegram_id] = self.last_activity
 
-            # Check if new user
-            is_new_user = telegram_id not in self.engagement_scores
-
-            # Update engagement score
-            if telegram_id not in self.engagement_scores:
-                self.engagement_scores[telegram_id] = 0
-            self.engagement_scores[telegram_id] += 1
+            # Update engagement score, noting whether this is a new user
+            engagement_score, is_new_user = await self.engagement.increment(telegram_id)
 
             # Update daily stats in database
             try:
@@ -2151,9 +2327,8 @@ class RentungBot_Ai:
             
             # Check for registration keywords first (before conversation engine)
             message_lower = message_text.lower().strip()
-            registration_keywords = ['daftar', 'register', 'join', 'signup', 'sign up', 'masuk', 'sertai']
             
-            if any(keyword in message_lower for keyword in registration_keywords):
+            if REGISTRATION_KEYWORDS_RE.search(message_lower):
                 logger.info(f"🎯 Registration keyword detected: {message_text}")
                 
                 # Check if it's specifically for VIP, Campaign, or Indicator
@@ -2162,7 +2337,7 @@ class RentungBot_Ai:
                     logger.info("🔹 VIP registration detected, redirecting to VIP flow")
                     await self.register_command(update, context)
                     return
-                elif any(camp_word in message_lower for camp_word in ['campaign', 'kempen', 'bonus', 'reward']):
+                elif CAMPAIGN_KEYWORDS_RE.search(message_lower):
                     # Directly go to campaign selection
                     logger.info("🔸 Campaign registration detected, redirecting to campaign selection")
                     await self.show_campaign_selection(update, context)
@@ -2178,19 +2353,25 @@ class RentungBot_Ai:
                     await self.show_registration_choice(update, context)
                     return
             
-            # Process message through conversation engine
+            # Process message through conversation engine, showing AI text as it streams
+            streaming_reply = StreamingReply(update)
             try:
                 logger.info(f"🧠 Sending to conversation engine...")
                 response = await self.conversation_engine.process_message(
                     message_text, 
                     telegram_id, 
-                    self.engagement_scores[telegram_id],
-                    user.username or ""
+                    engagement_score,
+                    user.username or "",
+                    on_partial=streaming_reply.append
                 )
                 logger.info(f"💭 Got response from conversation engine: {response[:100]}...")
             except Exception as e:
                 logger.error(f"❌ Conversation engine error: {e}", exc_info=True)
                 response = None
+            except BaseException:
+                # Cancelled mid-reply: stop editing and let the cancellation propagate
+                streaming_reply.cancel()
+                raise
 
             # Ensure we have a valid response
             if not response or response.strip() == "":
@@ -2201,7 +2382,7 @@ class RentungBot_Ai:
                 logger.warning(f"Using fallback response")
 
             logger.info(f"📤 Sending reply to user...")
-            await send_long_message(update, response)
+            await streaming_reply.finish(response)
             logger.info(f"✅ Message handled successfully")
             
         except Exception as e:
@@ -2258,7 +2439,7 @@ class RentungBot_Ai:
             'success_rate': round(success_rate, 1),
             'error_count': self.error_count,
             'last_activity': self.last_activity.isoformat() if self.last_activity else None,
-            'engagement_scores': dict(list(sorted(self.engagement_scores.items(), 
+            'engagement_scores': dict(list(sorted(self.engagement.scores.items(), 
                                                 key=lambda x: x[1], reverse=True))[:5])
         }
 
@@ -2478,7 +2659,7 @@ async def process_language_selection(request: Request, token: str = Form(...), l
         })
     
     # Validate language
-    if language not in ['ms', 'en', 'id']:
+    if language not in SUPPORTED_LANGUAGES:
         language = 'ms'  # Default fallback
     
     # Create new token with language preference
@@ -2562,7 +2743,7 @@ async def account_setup_continue(request: Request, token: str = Form(...), setup
         })
     
     # Validate setup_action
-    if setup_action not in ['new_account', 'partner_change']:
+    if setup_action not in SETUP_ACTIONS:
         return templates.TemplateResponse("error.html", {
             "request": request,
             "error_message": translations.get("invalid_setup_action", "Invalid setup action selected"),
@@ -2644,7 +2825,7 @@ async def account_setup_continue(request: Request, token: str = Form(...), setup
         })
 
 @app.get("/registration-form", response_class=HTMLResponse)
-async def registration_form(request: Request, token: str = None):
+async def registration_form(request: Request, token: str = None, db: Optional[Session] = Depends(get_db_session)):
     """Registration form page (Step 2)"""
     # Get language preference
     lang = get_language_from_request(request)
@@ -2675,45 +2856,40 @@ async def registration_form(request: Request, token: str = None):
     existing_registration = None
     setup_action = request.query_params.get('setup_action')
     
-    if SessionLocal:
-        db = get_db()
-        if db:
-            try:
-                # For resubmission tokens, get existing registration data
-                if token_type == "resubmission" and token_data.get('registration_id'):
-                    existing_registration = db.query(VipRegistration).filter_by(
-                        id=token_data['registration_id']
-                    ).first()
-                else:
-                    # Check if Step 1 was completed for new registrations
-                    existing = db.query(VipRegistration).filter_by(telegram_id=telegram_id).first()
+    if db:
+        # For resubmission tokens, get existing registration data
+        if token_type == "resubmission" and token_data.get('registration_id'):
+            existing_registration = await asyncio.to_thread(
+                db.query(VipRegistration).filter_by(id=token_data['registration_id']).first
+            )
+        else:
+            # Check if Step 1 was completed for new registrations
+            existing = await asyncio.to_thread(db.query(VipRegistration).filter_by(telegram_id=telegram_id).first)
                     
-                    if existing:
-                        # Check if user already completed full registration
-                        if existing.step_completed >= 2:
-                            return templates.TemplateResponse("error.html", {
-                                "request": request,
-                                "error_message": TRANSLATIONS['ms']['already_registered'],
-                                "translations": TRANSLATIONS['ms'],
-                                "lang": "ms"
-                            })
+            if existing:
+                # Check if user already completed full registration
+                if existing.step_completed >= 2:
+                    return templates.TemplateResponse("error.html", {
+                        "request": request,
+                        "error_message": TRANSLATIONS['ms']['already_registered'],
+                        "translations": TRANSLATIONS['ms'],
+                        "lang": "ms"
+                    })
                         
-                        # Check if Step 1 was completed
-                        if existing.step_completed < 1 or not existing.account_setup_action:
-                            # User hasn't completed Step 1, redirect them back
-                            new_token = generate_registration_token(telegram_id, telegram_username or "")
-                            return RedirectResponse(url=f"/account-setup?token={new_token}", status_code=302)
+                # Check if Step 1 was completed
+                if existing.step_completed < 1 or not existing.account_setup_action:
+                    # User hasn't completed Step 1, redirect them back
+                    new_token = generate_registration_token(telegram_id, telegram_username or "")
+                    return RedirectResponse(url=f"/account-setup?token={new_token}", status_code=302)
                         
-                        # User completed Step 1, continue with Step 2
-                        existing_registration = existing
-                        setup_action = existing.account_setup_action.value if existing.account_setup_action else None
-                    else:
-                        # No existing registration and no setup_action, redirect to Step 1
-                        if not setup_action:
-                            new_token = generate_registration_token(telegram_id, telegram_username or "")
-                            return RedirectResponse(url=f"/account-setup?token={new_token}", status_code=302)
-            finally:
-                db.close()
+                # User completed Step 1, continue with Step 2
+                existing_registration = existing
+                setup_action = existing.account_setup_action.value if existing.account_setup_action else None
+            else:
+                # No existing registration and no setup_action, redirect to Step 1
+                if not setup_action:
+                    new_token = generate_registration_token(telegram_id, telegram_username or "")
+                    return RedirectResponse(url=f"/account-setup?token={new_token}", status_code=302)
     
     form_hash = generate_form_hash()
     template_data = {
@@ -2735,6 +2911,7 @@ async def registration_form(request: Request, token: str = None):
 @app.post("/submit")
 async def submit_registration(
     request: Request,
+    background_tasks: BackgroundTasks,
     token: str = Form(...),
     full_name: str = Form(...),
     email: str = Form(...),
@@ -2744,7 +2921,8 @@ async def submit_registration(
     client_id: str = Form(...),
     deposit_proof_1: UploadFile = File(None),
     deposit_proof_2: UploadFile = File(None),
-    deposit_proof_3: UploadFile = File(None)
+    deposit_proof_3: UploadFile = File(None),
+    db: Optional[Session] = Depends(get_db_session)
 ):
     """Process registration form submission"""
     logger.info("🚨 Registration form submitted")
@@ -2803,9 +2981,8 @@ async def submit_registration(
     try:
         # Try parsing with different regions for common formats
         parsed_phone = None
-        regions_to_try = ['MY', 'ID', None]  # Malaysia, Indonesia, then no region
         
-        for region in regions_to_try:
+        for region in PHONE_REGIONS_TO_TRY:
             try:
                 parsed_phone = phonenumbers.parse(phone_number, region)
                 if phonenumbers.is_valid_number(parsed_phone):
@@ -2831,151 +3008,144 @@ async def submit_registration(
     logger.info(f"Files saved: {deposit_proof_1_path}, {deposit_proof_2_path}, {deposit_proof_3_path}")
     
     # Save to database if available
-    if SessionLocal:
-        db = get_db()
-        if db:
-            try:
-                if is_resubmission and registration_id:
-                    # Update existing registration
-                    existing_registration = db.query(VipRegistration).filter_by(id=registration_id).first()
-                    if existing_registration:
-                        # Update fields
-                        existing_registration.full_name = full_name.strip()
-                        existing_registration.email = email.strip()
-                        existing_registration.phone_number = phone_number.strip()
-                        existing_registration.brokerage_name = brokerage_name.strip()
-                        existing_registration.deposit_amount = deposit_amount.strip()
-                        existing_registration.client_id = client_id.strip()
+    if db:
+        try:
+            if is_resubmission and registration_id:
+                # Update existing registration
+                existing_registration = await asyncio.to_thread(db.query(VipRegistration).filter_by(id=registration_id).first)
+                if existing_registration:
+                    # Update fields
+                    existing_registration.full_name = full_name.strip()
+                    existing_registration.email = email.strip()
+                    existing_registration.phone_number = phone_number.strip()
+                    existing_registration.brokerage_name = brokerage_name.strip()
+                    existing_registration.deposit_amount = deposit_amount.strip()
+                    existing_registration.client_id = client_id.strip()
                         
-                        # Update file paths only if new files were uploaded
-                        if deposit_proof_1_path:
-                            existing_registration.deposit_proof_1_path = deposit_proof_1_path
-                        if deposit_proof_2_path:
-                            existing_registration.deposit_proof_2_path = deposit_proof_2_path
-                        if deposit_proof_3_path:
-                            existing_registration.deposit_proof_3_path = deposit_proof_3_path
+                    # Update file paths only if new files were uploaded
+                    if deposit_proof_1_path:
+                        existing_registration.deposit_proof_1_path = deposit_proof_1_path
+                    if deposit_proof_2_path:
+                        existing_registration.deposit_proof_2_path = deposit_proof_2_path
+                    if deposit_proof_3_path:
+                        existing_registration.deposit_proof_3_path = deposit_proof_3_path
                         
-                        # Reset status to pending for re-review
-                        existing_registration.status = RegistrationStatus.PENDING
-                        existing_registration.on_hold_reason = None
-                        existing_registration.custom_message = None
-                        existing_registration.status_updated_at = datetime.utcnow()
+                    # Reset status to pending for re-review
+                    existing_registration.status = RegistrationStatus.PENDING
+                    existing_registration.on_hold_reason = None
+                    existing_registration.custom_message = None
+                    existing_registration.status_updated_at = datetime.utcnow()
                         
-                        db.commit()
-                        logger.info(f"✅ Registration updated for {full_name} (ID: {registration_id})")
+                    registration_data = await asyncio.to_thread(_commit_and_serialize, db, existing_registration)
+                    logger.info(f"✅ Registration updated for {full_name} (ID: {registration_id})")
                         
-                        # Create audit log
-                        add_audit_log(
-                            registration_id=registration_id,
-                            action="RESUBMITTED",
-                            new_value="User resubmitted registration data",
-                            details="Registration updated via resubmission form"
-                        )
-                        
-                        # Send pending notification to user via bot
-                        await send_registration_pending(telegram_id, existing_registration.to_dict())
+                    # Create audit log
+                    await asyncio.to_thread(
+                        add_audit_log,
+                        registration_id=registration_id,
+                        action="RESUBMITTED",
+                        new_value="User resubmitted registration data",
+                        details="Registration updated via resubmission form"
+                    )
                         
-                        # Notify admin of resubmission
-                        await send_admin_notification(existing_registration.to_dict())
+                    # Telegram notifications go out after the redirect is sent
+                    background_tasks.add_task(send_registration_pending, telegram_id, registration_data)
+                    background_tasks.add_task(send_admin_notification, registration_data)
                         
-                    else:
-                        logger.error(f"Registration {registration_id} not found for resubmission")
-                        return templates.TemplateResponse("error.html", {
-                            "request": request,
-                            "error_message": "Pendaftaran tidak dijumpai",
-                            "translations": TRANSLATIONS['ms']
-                        })
                 else:
-                    # Check if user already has a completed registration
-                    existing_setup = db.query(VipRegistration).filter_by(telegram_id=telegram_id).first()
+                    logger.error(f"Registration {registration_id} not found for resubmission")
+                    return templates.TemplateResponse("error.html", {
+                        "request": request,
+                        "error_message": "Pendaftaran tidak dijumpai",
+                        "translations": TRANSLATIONS['ms']
+                    })
+            else:
+                # Check if user already has a completed registration
+                existing_setup = await asyncio.to_thread(db.query(VipRegistration).filter_by(telegram_id=telegram_id).first)
                     
-                    if existing_setup and existing_setup.step_completed >= 2:
-                        # User already has a completed registration - prevent duplicate
-                        logger.warning(f"🚫 Duplicate registration attempt by {telegram_id} ({full_name})")
-                        return templates.TemplateResponse("error.html", {
-                            "request": request,
-                            "error_message": f"Anda sudah mempunyai pendaftaran yang lengkap. Status semasa: {existing_setup.status.value}. Jika anda perlu mengemaskini maklumat, sila hubungi admin.",
-                            "translations": TRANSLATIONS['ms']
-                        })
+                if existing_setup and existing_setup.step_completed >= 2:
+                    # User already has a completed registration - prevent duplicate
+                    logger.warning(f"🚫 Duplicate registration attempt by {telegram_id} ({full_name})")
+                    return templates.TemplateResponse("error.html", {
+                        "request": request,
+                        "error_message": f"Anda sudah mempunyai pendaftaran yang lengkap. Status semasa: {existing_setup.status.value}. Jika anda perlu mengemaskini maklumat, sila hubungi admin.",
+                        "translations": TRANSLATIONS['ms']
+                    })
                     
-                    if existing_setup and existing_setup.step_completed >= 1:
-                        # User completed Step 1, update existing record with Step 2 data
-                        existing_setup.full_name = full_name.strip()
-                        existing_setup.email = email.strip()
-                        existing_setup.phone_number = phone_number.strip()
-                        existing_setup.brokerage_name = brokerage_name.strip()
-                        existing_setup.deposit_amount = deposit_amount.strip()
-                        existing_setup.client_id = client_id.strip()
-                        existing_setup.deposit_proof_1_path = deposit_proof_1_path
-                        existing_setup.deposit_proof_2_path = deposit_proof_2_path
-                        existing_setup.deposit_proof_3_path = deposit_proof_3_path
-                        existing_setup.ip_address = request.client.host
-                        existing_setup.user_agent = request.headers.get('User-Agent', '')
-                        existing_setup.step_completed = 2  # Both steps completed
-                        existing_setup.preferred_language = lang  # Save language preference
+                if existing_setup and existing_setup.step_completed >= 1:
+                    # User completed Step 1, update existing record with Step 2 data
+                    existing_setup.full_name = full_name.strip()
+                    existing_setup.email = email.strip()
+                    existing_setup.phone_number = phone_number.strip()
+                    existing_setup.brokerage_name = brokerage_name.strip()
+                    existing_setup.deposit_amount = deposit_amount.strip()
+                    existing_setup.client_id = client_id.strip()
+                    existing_setup.deposit_proof_1_path = deposit_proof_1_path
+                    existing_setup.deposit_proof_2_path = deposit_proof_2_path
+                    existing_setup.deposit_proof_3_path = deposit_proof_3_path
+                    existing_setup.ip_address = request.client.host
+                    existing_setup.user_agent = request.headers.get('User-Agent', '')
+                    existing_setup.step_completed = 2  # Both steps completed
+                    existing_setup.preferred_language = lang  # Save language preference
                         
-                        db.commit()
-                        logger.info(f"✅ Registration completed for {full_name} (updated existing record)")
+                    registration_data = await asyncio.to_thread(_commit_and_serialize, db, existing_setup)
+                    logger.info(f"✅ Registration completed for {full_name} (updated existing record)")
                         
-                        # Add audit log for registration completion
-                        add_audit_log(
-                            registration_id=existing_setup.id,
-                            action="REGISTRATION_COMPLETED",
-                            details="User completed Step 2: Full registration form submitted"
-                        )
-                        
-                        # Send pending notification to user via bot
-                        await send_registration_pending(telegram_id, existing_setup.to_dict())
-                        
-                        # Notify admin
-                        await send_admin_notification(existing_setup.to_dict())
-                    else:
-                        # Create completely new registration (shouldn't happen with proper flow validation)
-                        new_registration = VipRegistration(
-                            telegram_id=telegram_id,
-                            telegram_username=telegram_username or '',
-                            full_name=full_name.strip(),
-                            email=email.strip(),
-                            phone_number=phone_number.strip(),
-                            brokerage_name=brokerage_name.strip(),
-                            deposit_amount=deposit_amount.strip(),
-                            client_id=client_id.strip(),
-                            deposit_proof_1_path=deposit_proof_1_path,
-                            deposit_proof_2_path=deposit_proof_2_path,
-                            deposit_proof_3_path=deposit_proof_3_path,
-                            ip_address=request.client.host,
-                            user_agent=request.headers.get('User-Agent', ''),
-                            step_completed=2,  # Both steps completed (edge case)
-                            preferred_language=lang  # Save language preference
-                        )
+                    # Add audit log for registration completion
+                    await asyncio.to_thread(
+                        add_audit_log,
+                        registration_id=registration_data['id'],
+                        action="REGISTRATION_COMPLETED",
+                        details="User completed Step 2: Full registration form submitted"
+                    )
                         
-                        db.add(new_registration)
-                        db.commit()
-                        logger.info(f"✅ New registration saved for {full_name}")
+                    # Telegram notifications go out after the redirect is sent
+                    background_tasks.add_task(send_registration_pending, telegram_id, registration_data)
+                    background_tasks.add_task(send_admin_notification, registration_data)
+                else:
+                    # Create completely new registration (shouldn't happen with proper flow validation)
+                    new_registration = VipRegistration(
+                        telegram_id=telegram_id,
+                        telegram_username=telegram_username or '',
+                        full_name=full_name.strip(),
+                        email=email.strip(),
+                        phone_number=phone_number.strip(),
+                        brokerage_name=brokerage_name.strip(),
+                        deposit_amount=deposit_amount.strip(),
+                        client_id=client_id.strip(),
+                        deposit_proof_1_path=deposit_proof_1_path,
+                        deposit_proof_2_path=deposit_proof_2_path,
+                        deposit_proof_3_path=deposit_proof_3_path,
+                        ip_address=request.client.host,
+                        user_agent=request.headers.get('User-Agent', ''),
+                        step_completed=2,  # Both steps completed (edge case)
+                        preferred_language=lang  # Save language preference
+                    )
                         
-                        # Add audit log
-                        add_audit_log(
-                            registration_id=new_registration.id,
-                            action="REGISTRATION_CREATED",
-                            details="Complete registration created (bypassed Step 1 validation)"
-                        )
+                    db.add(new_registration)
+                    registration_data = await asyncio.to_thread(_commit_and_serialize, db, new_registration)
+                    logger.info(f"✅ New registration saved for {full_name}")
                         
-                        # Send pending notification to user via bot
-                        await send_registration_pending(telegram_id, new_registration.to_dict())
+                    # Add audit log
+                    await asyncio.to_thread(
+                        add_audit_log,
+                        registration_id=registration_data['id'],
+                        action="REGISTRATION_CREATED",
+                        details="Complete registration created (bypassed Step 1 validation)"
+                    )
                         
-                        # Notify admin
-                        await send_admin_notification(new_registration.to_dict())
+                    # Telegram notifications go out after the redirect is sent
+                    background_tasks.add_task(send_registration_pending, telegram_id, registration_data)
+                    background_tasks.add_task(send_admin_notification, registration_data)
                 
-            except Exception as e:
-                logger.error(f"❌ Database save failed: {e}")
-                db.rollback()
-                return templates.TemplateResponse("error.html", {
-                    "request": request,
-                    "error_message": "Masalah teknikal dengan pangkalan data",
-                    "translations": TRANSLATIONS['ms']
-                })
-            finally:
-                db.close()
+        except Exception as e:
+            logger.error(f"❌ Database save failed: {e}")
+            await asyncio.to_thread(db.rollback)
+            return templates.TemplateResponse("error.html", {
+                "request": request,
+                "error_message": "Masalah teknikal dengan pangkalan data",
+                "translations": TRANSLATIONS['ms']
+            })
     
     # Redirect to success page
     return RedirectResponse(url=f"/success?token={token}&lang={lang}", status_code=303)
@@ -3165,7 +3335,7 @@ async def indicator_continue(request: Request, token: str = Form(...), setup_act
     
     try:
         # Validate setup_action
-        if setup_action not in ['new_account', 'partner_change']:
+        if setup_action not in SETUP_ACTIONS:
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "error_message": "Invalid setup action selected",
@@ -3338,9 +3508,8 @@ async def submit_indicator_registration(
     try:
         # Try parsing with different regions for common formats
         parsed_phone = None
-        regions_to_try = ['MY', 'ID', None]  # Malaysia, Indonesia, then no region
         
-        for region in regions_to_try:
+        for region in PHONE_REGIONS_TO_TRY:
             try:
                 parsed_phone = phonenumbers.parse(phone_number, region)
                 if phonenumbers.is_valid_number(parsed_phone):
@@ -3528,12 +3697,12 @@ async def indicator_success_page(request: Request, token: str = None):
             if db:
                 try:
                     # Look for VIP registration with indicator tag
-                    registration = db.query(VipRegistration).filter(
+                    indicator_registration_id = db.query(VipRegistration.id).filter(
                         VipRegistration.telegram_id == telegram_id,
                         VipRegistration.campaign_name == "High Level Engulfing Indicator"
-                    ).first()
-                    if registration:
-                        registration_id = f"IND{registration.id:04d}"
+                    ).limit(1).scalar()
+                    if indicator_registration_id:
+                        registration_id = f"IND{indicator_registration_id:04d}"
                 finally:
                     db.close()
     
@@ -3719,7 +3888,7 @@ async def send_registration_on_hold(telegram_id: str, registration_data: dict, c
             )
             
             # Get base URL from environment
-            base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+            base_url = BASE_URL
             resubmission_url = f"{base_url}/?token={resubmission_token}"
             
             on_hold_message = (
@@ -4216,28 +4385,21 @@ async def admin_dashboard(request: Request, admin = Depends(get_current_admin)):
     if SessionLocal:
         try:
             with SessionLocal() as db:
-                # Total registrations
-                total_registrations = db.query(VipRegistration).count()
+                # Status statistics: one grouped count, summed for the total
+                status_counts = dict(db.query(
+                    VipRegistration.status, func.count(VipRegistration.id)
+                ).group_by(VipRegistration.status).all())
+                total_registrations = sum(status_counts.values())
+                pending_count = status_counts.get(RegistrationStatus.PENDING, 0)
+                verified_count = status_counts.get(RegistrationStatus.VERIFIED, 0)
+                rejected_count = status_counts.get(RegistrationStatus.REJECTED, 0)
+                on_hold_count = status_counts.get(RegistrationStatus.ON_HOLD, 0)
                 
                 # Recent registrations (last 7 days)
                 week_ago = datetime.utcnow() - timedelta(days=7)
-                recent_registrations = db.query(VipRegistration).filter(
+                recent_registrations = db.query(func.count(VipRegistration.id)).filter(
                     VipRegistration.created_at >= week_ago
-                ).count()
-                
-                # Status statistics
-                pending_count = db.query(VipRegistration).filter(
-                    VipRegistration.status == RegistrationStatus.PENDING
-                ).count()
-                verified_count = db.query(VipRegistration).filter(
-                    VipRegistration.status == RegistrationStatus.VERIFIED
-                ).count()
-                rejected_count = db.query(VipRegistration).filter(
-                    VipRegistration.status == RegistrationStatus.REJECTED
-                ).count()
-                on_hold_count = db.query(VipRegistration).filter(
-                    VipRegistration.status == RegistrationStatus.ON_HOLD
-                ).count()
+                ).scalar()
                 
                 # Registrations by broker
                 broker_stats = db.query(
@@ -4246,36 +4408,29 @@ async def admin_dashboard(request: Request, admin = Depends(get_current_admin)):
                 ).group_by(VipRegistration.brokerage_name).all()
                 
                 # Campaign statistics
-                campaign_registrations = db.query(VipRegistration).filter(
+                campaign_registrations = db.query(func.count(VipRegistration.id)).filter(
                     VipRegistration.campaign_id.isnot(None)
-                ).count()
+                ).scalar()
                 
                 regular_registrations = total_registrations - campaign_registrations
                 
                 # Active campaigns
-                active_campaigns_count = db.query(Campaign).filter(
+                active_campaigns_count = db.query(func.count(Campaign.id)).filter(
                     Campaign.is_active == True
-                ).count()
+                ).scalar()
                 
-                # Indicator registration statistics
-                total_indicator_registrations = db.query(IndicatorRegistration).count()
-                recent_indicator_registrations = db.query(IndicatorRegistration).filter(
+                # Indicator registration statistics, by status in one grouped count
+                indicator_status_counts = dict(db.query(
+                    IndicatorRegistration.status, func.count(IndicatorRegistration.id)
+                ).group_by(IndicatorRegistration.status).all())
+                total_indicator_registrations = sum(indicator_status_counts.values())
+                indicator_pending_count = indicator_status_counts.get(RegistrationStatus.PENDING, 0)
+                indicator_verified_count = indicator_status_counts.get(RegistrationStatus.VERIFIED, 0)
+                indicator_rejected_count = indicator_status_counts.get(RegistrationStatus.REJECTED, 0)
+                indicator_on_hold_count = indicator_status_counts.get(RegistrationStatus.ON_HOLD, 0)
+                recent_indicator_registrations = db.query(func.count(IndicatorRegistration.id)).filter(
                     IndicatorRegistration.created_at >= week_ago
-                ).count()
-                
-                # Indicator status statistics
-                indicator_pending_count = db.query(IndicatorRegistration).filter(
-                    IndicatorRegistration.status == RegistrationStatus.PENDING
-                ).count()
-                indicator_verified_count = db.query(IndicatorRegistration).filter(
-                    IndicatorRegistration.status == RegistrationStatus.VERIFIED
-                ).count()
-                indicator_rejected_count = db.query(IndicatorRegistration).filter(
-                    IndicatorRegistration.status == RegistrationStatus.REJECTED
-                ).count()
-                indicator_on_hold_count = db.query(IndicatorRegistration).filter(
-                    IndicatorRegistration.status == RegistrationStatus.ON_HOLD
-                ).count()
+                ).scalar()
                 
                 # Indicator registrations by experience level
                 indicator_experience_stats = db.query(
@@ -5580,7 +5735,7 @@ async def send_resubmission_link(
         )
         
         # Get base URL from environment
-        base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+        base_url = BASE_URL
         resubmission_url = f"{base_url}/?token={resubmission_token}"
         
         # Send message to user
@@ -5780,155 +5935,139 @@ async def delete_all_registrations(admin = Depends(get_current_admin)):
     finally:
         db.close()
 
+# Seed data for create_test_registrations: one tuple per user, in TEST_USER_COLUMNS order
+TEST_USER_COLUMNS = (
+    "telegram_id", "telegram_username", "full_name", "email", "phone_number",
+    "client_id", "brokerage_name", "deposit_amount", "status", "days_ago"
+)
+TEST_USERS = [
+    # 10 Verified Users
+    ("1234567890", "ahmad_trader", "Ahmad Bin Abdullah", "ahmad.abdullah@gmail.com",
+     "+60123456789", "EXNESS_MY_001", "Exness", 500, "verified", 5),
+    ("2345678901", "siti_forex", "Siti Nurhaliza Binti Rashid", "siti.nurhaliza@yahoo.com",
+     "+60198765432", "XM_MY_002", "XM Global", 750, "verified", 8),
+    ("3456789012", "mohd_profit", "Mohammad Hafiz Bin Omar", "hafiz.omar@hotmail.com",
+     "+60187654321", "FXCM_MY_003", "FXCM", 300, "verified", 12),
+    ("4567890123", "farah_trading", "Farah Aisyah Binti Zainal", "farah.aisyah@gmail.com",
+     "+60176543210", "IC_MARKETS_004", "IC Markets", 1000, "verified", 3),
+    ("5678901234", "azman_fx", "Azman Bin Yusof", "azman.yusof@gmail.com",
+     "+60165432109", "PEPPERSTONE_005", "Pepperstone", 600, "verified", 15),
+    ("6789012345", "lisa_invest", "Lisa Tan Wei Ling", "lisa.tan@outlook.com",
+     "+60154321098", "AVATRADE_006", "AvaTrade", 450, "verified", 7),
+    ("7890123456", "rizal_capital", "Rizal Bin Hashim", "rizal.hashim@gmail.com",
+     "+60143210987", "FXTM_007", "FXTM", 800, "verified", 20),
+    ("8901234567", "nina_trader", "Nina Safiya Binti Ahmad", "nina.safiya@yahoo.com",
+     "+60132109876", "HOTFOREX_008", "HotForex", 550, "verified", 1),
+    ("9012345678", "daniel_pro", "Daniel Lim Chee Wei", "daniel.lim@gmail.com",
+     "+60121098765", "PLUS500_009", "Plus500", 900, "verified", 10),
+    ("0123456789", "sarah_wealth", "Sarah Binti Ibrahim", "sarah.ibrahim@hotmail.com",
+     "+60110987654", "TICKMILL_010", "Tickmill", 650, "verified", 6),
+    # 5 Rejected Users
+    ("1111111111", "rejected_user1", "Ali Bin Hassan", "ali.hassan@gmail.com",
+     "+60191111111", "INVALID_001", "Unknown Broker", 100, "rejected", 2),
+    ("2222222222", "rejected_user2", "Mira Binti Kamal", "fake.email@invalid.com",
+     "+60192222222", "FAKE_002", "Scam Broker", 200, "rejected", 4),
+    ("3333333333", "rejected_user3", "Kumar Ramasamy", "kumar.test@test.com",
+     "+60193333333", "TEST_003", "Test Broker", 150, "rejected", 9),
+    ("4444444444", "rejected_user4", "Wei Ming Tan", "weiming@dummy.com",
+     "+60194444444", "DUMMY_004", "Fake Markets", 75, "rejected", 11),
+    ("5555555555", "rejected_user5", "Raj Singh", "raj.singh@invalid.org",
+     "+60195555555", "INVALID_005", "Non-existent Broker", 250, "rejected", 14)
+]
+
+# Upper bound on users per status for one create-test-data call, and rows per INSERT
+MAX_TEST_USERS_PER_STATUS = 10000
+TEST_DATA_CHUNK_SIZE = 1000
+# Seeds the generated users and their status-update offsets so reruns produce the same data
+TEST_DATA_SEED = 42
+
+def generate_test_users(n_verified: int = 10, n_rejected: int = 5, seed: int = TEST_DATA_SEED):
+    """Yield seed rows lazily: the curated TEST_USERS first, then generated users past them"""
+    rng = random.Random(seed)
+    status_index = TEST_USER_COLUMNS.index("status")
+    brokers_index = TEST_USER_COLUMNS.index("brokerage_name")
+    deposit_index = TEST_USER_COLUMNS.index("deposit_amount")
+    for id_prefix, status, count in (("8", "verified", n_verified), ("9", "rejected", n_rejected)):
+        curated = [seed_row for seed_row in TEST_USERS if seed_row[status_index] == status]
+        yield from curated[:count]
+        brokers = tuple(seed_row[brokers_index] for seed_row in curated)
+        deposits = tuple(seed_row[deposit_index] for seed_row in curated)
+        for n in range(len(curated) + 1, count + 1):
+            yield (
+                f"{id_prefix}{n:09d}", f"test_{status}_{n}", f"Test User {status.title()} {n}", f"test.{status}.{n}@example.com",
+                f"+601{id_prefix}{n:07d}", f"TEST_{status.upper()}_{n:05d}", rng.choice(brokers), rng.choice(deposits), status, rng.randint(1, 30)
+            )
+
+def _seed_test_registrations(verified: int, rejected: int) -> tuple[int, int]:
+    """Insert seeded test registrations and return (created, skipped) counts"""
+    created_count = 0
+    skipped_count = 0
+    test_users = generate_test_users(verified, rejected)
+    offset_rng = random.Random(TEST_DATA_SEED)
+    registrations = VipRegistration.__table__
+    # Built once; the engine's compiled cache then reuses its SQL for every chunk
+    insert_registrations = insert(registrations)
+    
+    # Seed rows are never read back, so write them through Core in one
+    # transaction and skip the ORM's unit-of-work bookkeeping
+    with engine.begin() as conn:
+        # Insert in fixed-size chunks so memory stays flat however many users are requested
+        while chunk := list(islice(test_users, TEST_DATA_CHUNK_SIZE)):
+            # Look up the chunk's existing registrations in one query
+            existing_ids = set(conn.execute(
+                select(registrations.c.telegram_id).where(
+                    registrations.c.telegram_id.in_([seed_row[0] for seed_row in chunk])
+                )
+            ).scalars())
+            
+            now = datetime.utcnow()
+            
+            rows = []
+            for seed_row in chunk:
+                user_data = dict(zip(TEST_USER_COLUMNS, seed_row))
+                # Check if user already exists
+                if user_data["telegram_id"] in existing_ids:
+                    skipped_count += 1
+                    continue
+                existing_ids.add(user_data["telegram_id"])
+                
+                # Calculate registration date
+                registration_date = now - timedelta(days=user_data["days_ago"])
+                
+                # Queue the registration row; the chunk is inserted in one statement below
+                rows.append({
+                    "telegram_id": user_data["telegram_id"],
+                    "telegram_username": user_data["telegram_username"],
+                    "full_name": user_data["full_name"],
+                    "email": user_data["email"],
+                    "phone_number": user_data["phone_number"],
+                    "client_id": user_data["client_id"],
+                    "brokerage_name": user_data["brokerage_name"],
+                    "deposit_amount": user_data["deposit_amount"],
+                    "status": RegistrationStatus.VERIFIED if user_data["status"] == "verified" else RegistrationStatus.REJECTED,
+                    "ip_address": "127.0.0.1",
+                    "user_agent": "Mozilla/5.0 (Test Data Generator)",
+                    "created_at": registration_date,
+                    "status_updated_at": registration_date + timedelta(hours=offset_rng.randint(1, 48)),
+                    "updated_by_admin": "test_admin"
+                })
+            
+            if rows:
+                conn.execute(insert_registrations, rows)
+                created_count += len(rows)
+    
+    return created_count, skipped_count
+
 @app.post("/admin/registrations/create-test-data")
-async def create_test_registrations(admin = Depends(get_current_admin)):
-    """Create test registration data - 10 verified, 5 rejected (admin only)"""
-    if not SessionLocal:
+async def create_test_registrations(verified: int = 10, rejected: int = 5, admin = Depends(get_current_admin)):
+    """Create test registration data - 10 verified, 5 rejected by default (admin only)"""
+    if not (0 <= verified <= MAX_TEST_USERS_PER_STATUS and 0 <= rejected <= MAX_TEST_USERS_PER_STATUS):
+        raise HTTPException(status_code=400, detail=f"verified and rejected must be between 0 and {MAX_TEST_USERS_PER_STATUS}")
+    if not engine:
         raise HTTPException(status_code=500, detail="Database not available")
     
-    db = get_db()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    
-    # Test registration data
-    test_users = [
-        # 10 Verified Users
-        {
-            "telegram_id": "1234567890", "telegram_username": "ahmad_trader", 
-            "full_name": "Ahmad Bin Abdullah", "email": "ahmad.abdullah@gmail.com",
-            "phone_number": "+60123456789", "client_id": "EXNESS_MY_001",
-            "brokerage_name": "Exness", "deposit_amount": 500, "status": "verified", "days_ago": 5
-        },
-        {
-            "telegram_id": "2345678901", "telegram_username": "siti_forex",
-            "full_name": "Siti Nurhaliza Binti Rashid", "email": "siti.nurhaliza@yahoo.com", 
-            "phone_number": "+60198765432", "client_id": "XM_MY_002",
-            "brokerage_name": "XM Global", "deposit_amount": 750, "status": "verified", "days_ago": 8
-        },
-        {
-            "telegram_id": "3456789012", "telegram_username": "mohd_profit",
-            "full_name": "Mohammad Hafiz Bin Omar", "email": "hafiz.omar@hotmail.com",
-            "phone_number": "+60187654321", "client_id": "FXCM_MY_003", 
-            "brokerage_name": "FXCM", "deposit_amount": 300, "status": "verified", "days_ago": 12
-        },
-        {
-            "telegram_id": "4567890123", "telegram_username": "farah_trading",
-            "full_name": "Farah Aisyah Binti Zainal", "email": "farah.aisyah@gmail.com",
-            "phone_number": "+60176543210", "client_id": "IC_MARKETS_004",
-            "brokerage_name": "IC Markets", "deposit_amount": 1000, "status": "verified", "days_ago": 3
-        },
-        {
-            "telegram_id": "5678901234", "telegram_username": "azman_fx",
-            "full_name": "Azman Bin Yusof", "email": "azman.yusof@gmail.com",
-            "phone_number": "+60165432109", "client_id": "PEPPERSTONE_005",
-            "brokerage_name": "Pepperstone", "deposit_amount": 600, "status": "verified", "days_ago": 15
-        },
-        {
-            "telegram_id": "6789012345", "telegram_username": "lisa_invest", 
-            "full_name": "Lisa Tan Wei Ling", "email": "lisa.tan@outlook.com",
-            "phone_number": "+60154321098", "client_id": "AVATRADE_006",
-            "brokerage_name": "AvaTrade", "deposit_amount": 450, "status": "verified", "days_ago": 7
-        },
-        {
-            "telegram_id": "7890123456", "telegram_username": "rizal_capital",
-            "full_name": "Rizal Bin Hashim", "email": "rizal.hashim@gmail.com", 
-            "phone_number": "+60143210987", "client_id": "FXTM_007",
-            "brokerage_name": "FXTM", "deposit_amount": 800, "status": "verified", "days_ago": 20
-        },
-        {
-            "telegram_id": "8901234567", "telegram_username": "nina_trader",
-            "full_name": "Nina Safiya Binti Ahmad", "email": "nina.safiya@yahoo.com",
-            "phone_number": "+60132109876", "client_id": "HOTFOREX_008",
-            "brokerage_name": "HotForex", "deposit_amount": 550, "status": "verified", "days_ago": 1
-        },
-        {
-            "telegram_id": "9012345678", "telegram_username": "daniel_pro",
-            "full_name": "Daniel Lim Chee Wei", "email": "daniel.lim@gmail.com",
-            "phone_number": "+60121098765", "client_id": "PLUS500_009", 
-            "brokerage_name": "Plus500", "deposit_amount": 900, "status": "verified", "days_ago": 10
-        },
-        {
-            "telegram_id": "0123456789", "telegram_username": "sarah_wealth",
-            "full_name": "Sarah Binti Ibrahim", "email": "sarah.ibrahim@hotmail.com",
-            "phone_number": "+60110987654", "client_id": "TICKMILL_010",
-            "brokerage_name": "Tickmill", "deposit_amount": 650, "status": "verified", "days_ago": 6
-        },
-        
-        # 5 Rejected Users
-        {
-            "telegram_id": "1111111111", "telegram_username": "rejected_user1",
-            "full_name": "Ali Bin Hassan", "email": "ali.hassan@gmail.com",
-            "phone_number": "+60191111111", "client_id": "INVALID_001",
-            "brokerage_name": "Unknown Broker", "deposit_amount": 100, "status": "rejected", "days_ago": 2
-        },
-        {
-            "telegram_id": "2222222222", "telegram_username": "rejected_user2",
-            "full_name": "Mira Binti Kamal", "email": "fake.email@invalid.com",
-            "phone_number": "+60192222222", "client_id": "FAKE_002", 
-            "brokerage_name": "Scam Broker", "deposit_amount": 200, "status": "rejected", "days_ago": 4
-        },
-        {
-            "telegram_id": "3333333333", "telegram_username": "rejected_user3",
-            "full_name": "Kumar Ramasamy", "email": "kumar.test@test.com",
-            "phone_number": "+60193333333", "client_id": "TEST_003",
-            "brokerage_name": "Test Broker", "deposit_amount": 150, "status": "rejected", "days_ago": 9
-        },
-        {
-            "telegram_id": "4444444444", "telegram_username": "rejected_user4", 
-            "full_name": "Wei Ming Tan", "email": "weiming@dummy.com",
-            "phone_number": "+60194444444", "client_id": "DUMMY_004",
-            "brokerage_name": "Fake Markets", "deposit_amount": 75, "status": "rejected", "days_ago": 11
-        },
-        {
-            "telegram_id": "5555555555", "telegram_username": "rejected_user5",
-            "full_name": "Raj Singh", "email": "raj.singh@invalid.org",
-            "phone_number": "+60195555555", "client_id": "INVALID_005",
-            "brokerage_name": "Non-existent Broker", "deposit_amount": 250, "status": "rejected", "days_ago": 14
-        }
-    ]
-    
     try:
-        created_count = 0
-        skipped_count = 0
-        
-        for user_data in test_users:
-            # Check if user already exists
-            existing_user = db.query(VipRegistration).filter_by(
-                telegram_id=user_data["telegram_id"]
-            ).first()
-            
-            if existing_user:
-                skipped_count += 1
-                continue
-            
-            # Calculate registration date
-            registration_date = datetime.utcnow() - timedelta(days=user_data["days_ago"])
-            
-            # Create registration record
-            registration = VipRegistration(
-                telegram_id=user_data["telegram_id"],
-                telegram_username=user_data["telegram_username"], 
-                full_name=user_data["full_name"],
-                email=user_data["email"],
-                phone_number=user_data["phone_number"],
-                client_id=user_data["client_id"],
-                brokerage_name=user_data["brokerage_name"],
-                deposit_amount=user_data["deposit_amount"],
-                status=RegistrationStatus.VERIFIED if user_data["status"] == "verified" else RegistrationStatus.REJECTED,
-                ip_address="127.0.0.1",
-                user_agent="Mozilla/5.0 (Test Data Generator)",
-                created_at=registration_date,
-                status_updated_at=registration_date + timedelta(hours=random.randint(1, 48)),
-                updated_by_admin="test_admin"
-            )
-            
-            db.add(registration)
-            created_count += 1
-        
-        db.commit()
-        
-        verified_count = len([u for u in test_users if u["status"] == "verified"])
-        rejected_count = len([u for u in test_users if u["status"] == "rejected"])
+        created_count, skipped_count = await asyncio.to_thread(_seed_test_registrations, verified, rejected)
         
         logger.info(f"✅ Test data created by {admin.get('username')} - {created_count} records created")
         
@@ -5937,17 +6076,15 @@ async def create_test_registrations(admin = Depends(get_current_admin)):
             "message": f"Test data created successfully",
             "created": created_count,
             "skipped": skipped_count,
-            "verified": verified_count,
-            "rejected": rejected_count,
-            "total": len(test_users)
+            "verified": verified,
+            "rejected": rejected,
+            "total": created_count + skipped_count
         })
         
     except Exception as e:
+        # engine.begin() has already rolled the transaction back
         logger.error(f"Error creating test data: {e}")
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create test data: {str(e)}")
-    finally:
-        db.close()
 
 @app.post("/admin/registrations/import")
 async def import_registrations(
@@ -7350,7 +7487,7 @@ async def debug_test_campaign_token():
             campaign_id="rm50-bonus"
         )
         
-        base_url = os.getenv('BASE_URL', 'https://ezyassist-unified-production.up.railway.app')
+        base_url = BASE_URL
         campaign_url = f"{base_url}/campaign/rm50-bonus?token={token}"
         
         return {
@@ -8063,7 +8200,7 @@ async def campaign_continue(request: Request, campaign_id: str, token: str = For
     
     try:
         # Validate setup_action
-        if setup_action not in ['new_account', 'partner_change']:
+        if setup_action not in SETUP_ACTIONS:
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "error_message": "Invalid setup action selected",
@@ -8318,9 +8455,8 @@ async def submit_campaign_registration(
         try:
             # Try parsing with different regions for common formats
             parsed_phone = None
-            regions_to_try = ['MY', 'ID', None]  # Malaysia, Indonesia, then no region
             
-            for region in regions_to_try:
+            for region in PHONE_REGIONS_TO_TRY:
                 try:
                     parsed_phone = phonenumbers.parse(phone_number, region)
                     if phonenumbers.is_valid_number(parsed_phone):
@@ -8896,6 +9032,12 @@ async def startup_event():
     # Setup bot webhook
     asyncio.create_task(setup_bot_webhook())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled outbound connections"""
+    await bot_instance.conversation_engine.aclose()
+    await bot_instance.engagement.aclose()
+
 if __name__ == "__main__":
     port = int(os.getenv('PORT', 8000))
     uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
\ No newline at end of file
@@ -0,0 +1,26 @@
+"""Persona system prompts must stay long enough for OpenAI prompt caching"""
+import pytest
+
+from conversation_engine import SYSTEM_PROMPT_BASES
+
+tiktoken = pytest.importorskip("tiktoken")
+
+# OpenAI only caches prompt prefixes of at least this many tokens
+PROMPT_CACHE_THRESHOLD = 1024
+
+
+@pytest.fixture(scope="module")
+def encoding():
+    # The BPE ranks are downloaded on first use and cached afterwards
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        pytest.skip(f"o200k_base encoding unavailable: {e}")
+
+
+@pytest.mark.parametrize("language", sorted(SYSTEM_PROMPT_BASES))
+def test_padded_base_reaches_cache_threshold(encoding, language):
+    token_count = len(encoding.encode(SYSTEM_PROMPT_BASES[language]))
+    assert token_count >= PROMPT_CACHE_THRESHOLD, (
+        f"{language} system prompt is {token_count} tokens, below the {PROMPT_CACHE_THRESHOLD}-token cache threshold"
+    )